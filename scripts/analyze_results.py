@@ -0,0 +1,192 @@
+import argparse
+import glob
+import os
+import numpy as np
+
+def find_runs(paths):
+    """Group result files into runs: all .npz files in one directory are one run."""
+    runs = {}
+    for path in paths:
+        if os.path.isdir(path):
+            files = glob.glob(os.path.join(path, "**", "*.npz"), recursive=True)
+        else:
+            files = glob.glob(path)
+        for f in files:
+            runs.setdefault(os.path.dirname(os.path.abspath(f)), []).append(f)
+    return [(name, sorted(files)) for name, files in sorted(runs.items())]
+
+def load_run(files):
+    """Return (steps, jobs, iso_thr, meta) for one run.
+
+    The scheduler's file sees every job and knows beta, link busy time and
+    isolated throughputs, so it is used when present; otherwise the
+    workers' files are merged (no slowdown or utilization then).
+    """
+    loaded = [np.load(f) for f in files]
+    sched = [d for d in loaded if str(d["role"]) == "scheduler"]
+    parts = sched[:1] or loaded
+    steps, jobs = [], []
+    for d in parts:
+        s = d["steps"].copy()
+        s["job"] += len(jobs)
+        steps.append(s)
+        jobs.extend(str(j) for j in d["jobs"])
+    if sched:
+        d = sched[0]
+        meta = {k: d[k] for k in ("beta", "link_gbps", "busy")}
+        iso = d["iso_thr"] if d["iso_thr"].size == len(jobs) else np.zeros(len(jobs))
+    else:
+        meta = {"beta": np.nan, "link_gbps": 0.0, "busy": np.nan}
+        iso = np.zeros(len(jobs))
+    return np.concatenate(steps), jobs, iso, meta
+
+def analyze(runs):
+    """Per-job and per-run metrics for many runs at once.
+
+    All steps go into one array with a global job index, and per-job
+    reductions are a sort plus reduceat; per-run reductions are bincounts
+    over the job arrays. Slowdown is the mean observed step time over the
+    isolated one (1 / iso_thr); Jain's index is over 1 / slowdown. Per-job
+    wait and step-time percentiles come from one lexsort of all rows.
+    """
+    steps, run_of_job, job_names, iso, meta = [], [], [], [], []
+    for r, (_, files) in enumerate(runs):
+        s, jobs, iso_thr, m = load_run(files)
+        s["job"] += len(job_names)
+        steps.append(s)
+        run_of_job += [r] * len(jobs)
+        job_names += jobs
+        iso.append(iso_thr)
+        meta.append(m)
+    steps = np.concatenate(steps)
+    run_of_job = np.array(run_of_job)
+    iso = np.concatenate(iso)
+    n_runs, n_jobs = len(runs), len(job_names)
+
+    order = np.argsort(steps["job"], kind="stable")
+    s = steps[order]
+    bounds = np.flatnonzero(np.r_[True, np.diff(s["job"]) != 0])
+    job = s["job"][bounds]
+    step_time = s["step_time"].astype(float)
+    first = np.full(n_jobs, np.nan)
+    last = np.full(n_jobs, np.nan)
+    n = np.zeros(n_jobs)
+    nbytes = np.zeros(n_jobs)
+    mean_step = np.full(n_jobs, np.nan)
+    first[job] = np.minimum.reduceat(s["end"] - step_time, bounds)
+    last[job] = np.maximum.reduceat(s["end"], bounds)
+    n[job] = np.diff(np.r_[bounds, len(s)])
+    nbytes[job] = np.add.reduceat(s["bytes"].astype(float), bounds)
+    mean_step[job] = np.add.reduceat(step_time, bounds) / n[job]
+
+    def job_percentile(field, q):
+        # Rows are grouped by job already; sort each group by the field and pick ranks
+        v = s[field][np.lexsort((s[field], s["job"]))]
+        out = np.full(n_jobs, np.nan)
+        out[job] = v[bounds + ((n[job] - 1) * q / 100.0).astype(int)]
+        return out
+
+    wait_p50, wait_p99, step_p99 = job_percentile("wait", 50), job_percentile("wait", 99), job_percentile("step_time", 99)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jct = last - first
+        steps_per_s = n / jct
+        bytes_per_s = nbytes / jct
+        slowdown = np.where(iso > 0, mean_step * iso, np.nan)
+        norm = 1.0 / slowdown
+
+        run_first = np.full(n_runs, np.inf)
+        run_last = np.full(n_runs, -np.inf)
+        np.minimum.at(run_first, run_of_job, np.nan_to_num(first, nan=np.inf))
+        np.maximum.at(run_last, run_of_job, np.nan_to_num(last, nan=-np.inf))
+        span = run_last - run_first
+        max_jct = np.full(n_runs, -np.inf)
+        np.maximum.at(max_jct, run_of_job, np.nan_to_num(jct, nan=-np.inf))
+        max_wait_p99 = np.full(n_runs, -np.inf)
+        np.maximum.at(max_wait_p99, run_of_job, np.nan_to_num(wait_p99, nan=-np.inf))
+
+        beta = np.array([float(m["beta"]) for m in meta])
+        busy = np.array([float(m["busy"]) for m in meta])
+        link_rate = np.array([float(m["link_gbps"]) for m in meta]) * 1e9 / 8
+        run_bytes = np.bincount(run_of_job, nbytes, n_runs)
+        k = np.bincount(run_of_job, minlength=n_runs)
+        # Any job without an isolated throughput makes the run's fairness unknown
+        S = np.bincount(run_of_job, norm, n_runs)
+        S2 = np.bincount(run_of_job, norm ** 2, n_runs)
+        runs_out = {
+            "beta": beta,
+            "jobs": k,
+            "span": span,
+            "link_busy": busy / span,
+            "link_util": np.where(link_rate > 0, run_bytes / (span * link_rate), np.nan),
+            "goodput_mbps": run_bytes * 8 / span / 1e6,
+            "jain": S ** 2 / (k * S2),
+            "mean_slowdown": np.bincount(run_of_job, slowdown, n_runs) / k,
+            "mean_jct": np.bincount(run_of_job, jct, n_runs) / k,
+            "max_jct": max_jct,
+            "max_wait_p99": max_wait_p99,
+        }
+    jobs_out = {"run": run_of_job, "job_id": np.array(job_names), "steps": n, "jct": jct,
+                "steps_per_s": steps_per_s, "bytes_per_s": bytes_per_s, "slowdown": slowdown,
+                "wait_p50": wait_p50, "wait_p99": wait_p99, "step_p99": step_p99}
+    return runs_out, jobs_out
+
+def plot_tradeoff(res, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(11, 4.5))
+    # Link busy fraction is known for every scheduler run; bytes/capacity only with --link_gbps
+    util = np.where(np.isnan(res["link_util"]), res["link_busy"], res["link_util"])
+    sc = ax1.scatter(util, res["jain"], c=res["beta"], cmap="viridis", s=12, alpha=0.7)
+    fig.colorbar(sc, ax=ax1, label="beta")
+    ax1.set_xlabel("link utilization")
+    ax1.set_ylabel("Jain's index (normalized throughput)")
+    ax1.set_title("Fairness vs utilization")
+
+    betas = np.unique(res["beta"][~np.isnan(res["beta"])])
+    idx = np.searchsorted(betas, res["beta"])
+    ok = ~np.isnan(res["beta"])
+    cnt = np.bincount(idx[ok], minlength=len(betas))
+    for key, label in (("mean_slowdown", "mean slowdown"), ("jain", "Jain's index")):
+        vals = res[key][ok]
+        good = ~np.isnan(vals)
+        mean = np.bincount(idx[ok][good], vals[good], len(betas)) / np.maximum(
+            np.bincount(idx[ok][good], minlength=len(betas)), 1)
+        ax2.plot(betas, mean, marker="o", label=label)
+    ax2.set_xlabel("beta")
+    ax2.set_title(f"Mean over {cnt.max() if len(cnt) else 0} repeat(s) per beta")
+    ax2.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    print(f"Plot written to {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize --results files from scheduler.py/worker.py runs")
+    parser.add_argument("paths", nargs="+",
+                        help="Result .npz files, globs or directories; files in one directory form one run")
+    parser.add_argument("--out", type=str, default=None, help="Save per-run and per-job arrays to this .npz file")
+    parser.add_argument("--plot", type=str, default=None, help="Write the fairness-utilization plot to this image")
+    parser.add_argument("--max_rows", type=int, default=50, help="Print at most this many runs")
+    args = parser.parse_args()
+
+    runs = find_runs(args.paths)
+    if not runs:
+        raise SystemExit("no result files found")
+    res, jobs = analyze(runs)
+
+    cols = ["beta", "jobs", "span", "link_busy", "link_util", "goodput_mbps", "jain", "mean_slowdown", "mean_jct",
+            "max_jct", "max_wait_p99"]
+    print(f"{'run':<24} " + " ".join(f"{c:>13}" for c in cols))
+    for r, (name, _) in enumerate(runs[:args.max_rows]):
+        print(f"{os.path.basename(name)[-24:]:<24} " + " ".join(f"{float(res[c][r]):>13.4f}" for c in cols))
+    if len(runs) > args.max_rows:
+        print(f"... {len(runs) - args.max_rows} more runs")
+
+    if args.out:
+        np.savez(args.out, run=np.array([name for name, _ in runs]), **res,
+                 **{f"job_{k}": v for k, v in jobs.items()})
+        print(f"Summary written to {args.out}")
+    if args.plot:
+        plot_tradeoff(res, args.plot)
@@ -0,0 +1,108 @@
+import socket
+import threading
+import time
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from utils import *
+
+def legacy_send_bulk(sock, data):
+    # Original implementation, kept here as the baseline
+    length = len(data)
+    sock.sendall(struct.pack('!Q', length))
+    sock.sendall(data)
+
+def legacy_recv_bulk(sock):
+    # Original implementation, kept here as the baseline
+    len_data = sock.recv(8)
+    if not len_data:
+        return None
+    length = struct.unpack('!Q', len_data)[0]
+
+    data = b""
+    while len(data) < length:
+        chunk = sock.recv(min(4096, length - len(data)))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def connected_pair(sock_buf):
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    tune_socket(srv, sock_buf)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+    tx = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tune_socket(tx, sock_buf)
+    tx.connect(srv.getsockname())
+    rx, _ = srv.accept()
+    srv.close()
+    return tx, rx
+
+def bench(name, payload_mb, transfers, sender, receiver, sock_buf):
+    tx, rx = connected_pair(sock_buf)
+    payload = b'a' * int(payload_mb * 1024 * 1024)
+
+    def feed():
+        for _ in range(transfers):
+            sender(tx, payload)
+        tx.shutdown(socket.SHUT_WR)
+
+    t = threading.Thread(target=feed)
+    t.daemon = True
+    start = time.perf_counter()
+    t.start()
+    total = receiver(rx)
+    elapsed = time.perf_counter() - start
+    t.join()
+    tx.close()
+    rx.close()
+    assert total == len(payload) * transfers, f"{name}: received {total} bytes"
+    gbps = total * 8 / elapsed / 1e9
+    print(f"{name:<34} {payload_mb:>6.1f} MB x {transfers:<4} {elapsed:8.3f}s  {gbps:8.2f} Gbit/s")
+    return gbps
+
+def drain_legacy(sock):
+    total = 0
+    while True:
+        data = legacy_recv_bulk(sock)
+        if not data:
+            return total
+        total += len(data)
+
+def drain_reuse(sock):
+    buf = bytearray(0)
+    total = 0
+    while True:
+        view = recv_bulk(sock, buf)
+        if view is None:
+            return total
+        if len(buf) < view.nbytes:
+            buf = view.obj
+        total += view.nbytes
+
+def drain_discard(sock):
+    scratch = bytearray(SINK_CHUNK_SIZE)
+    total = 0
+    while True:
+        length = discard_bulk(sock, scratch)
+        if length is None:
+            return total
+        total += length
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk data path benchmark over loopback TCP")
+    parser.add_argument("--payload_mb", type=float, default=50)
+    parser.add_argument("--transfers", type=int, default=20)
+    parser.add_argument("--legacy_payload_mb", type=float, default=4,
+                        help="Payload for the legacy path, which is quadratic in payload size")
+    parser.add_argument("--sock_buf_mb", type=float, default=SOCKET_BUFFER_SIZE / (1024 * 1024))
+    args = parser.parse_args()
+    sock_buf = int(args.sock_buf_mb * 1024 * 1024)
+
+    bench("legacy send/recv_bulk", args.legacy_payload_mb, 5, legacy_send_bulk, drain_legacy, 0)
+    bench("send_bulk + recv_bulk (reused buf)", args.payload_mb, args.transfers, send_bulk, drain_reuse, sock_buf)
+    bench("send_bulk + discard_bulk (sink)", args.payload_mb, args.transfers, send_bulk, drain_discard, sock_buf)
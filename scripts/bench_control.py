@@ -0,0 +1,78 @@
+import socket
+import threading
+import time
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from utils import *
+
+def feed(sock, count):
+    # Pre-encode so the sender is never the bottleneck
+    msg = {"job_id": "A", "compute_time": 0.0123, "payload_size": 1048576}
+    blob = (json.dumps(msg) + "\n").encode('utf-8') * count
+    sock.sendall(blob)
+    sock.shutdown(socket.SHUT_WR)
+
+def bench(name, count, read_all):
+    rx, tx = socket.socketpair()
+    t = threading.Thread(target=feed, args=(tx, count))
+    t.daemon = True
+    start = time.perf_counter()
+    t.start()
+    received = read_all(rx)
+    elapsed = time.perf_counter() - start
+    t.join()
+    rx.close()
+    tx.close()
+    assert received == count, f"{name}: expected {count} messages, got {received}"
+    print(f"{name:<28} {count:>8} msgs  {elapsed:8.3f}s  {count / elapsed:12.0f} msgs/s")
+    return count / elapsed
+
+def recv_json(sock):
+    """The original one-byte-per-recv() JSON line reader, as a baseline."""
+    try:
+        data = b""
+        while True:
+            chunk = sock.recv(1)
+            if not chunk:
+                return None
+            data += chunk
+            if chunk == b"\n":
+                break
+        return json.loads(data.decode('utf-8'))
+    except Exception:
+        return None
+
+def read_recv_json(sock):
+    n = 0
+    while recv_json(sock) is not None:
+        n += 1
+    return n
+
+def read_reader_one(sock):
+    reader = MessageReader(sock)
+    n = 0
+    while reader.recv() is not None:
+        n += 1
+    return n
+
+def read_reader_many(sock):
+    reader = MessageReader(sock)
+    n = 0
+    while True:
+        msgs = reader.recv_many()
+        if not msgs:
+            return n
+        n += len(msgs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Control-channel framing micro-benchmark")
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    base = bench("recv_json (byte-at-a-time)", args.messages, read_recv_json)
+    one = bench("MessageReader.recv", args.messages, read_reader_one)
+    many = bench("MessageReader.recv_many", args.messages, read_reader_many)
+    print(f"speedup: recv {one / base:.1f}x, recv_many {many / base:.1f}x")
@@ -0,0 +1,296 @@
+import argparse
+import gc
+import hashlib
+import heapq
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+import numpy as np
+from utils import *
+from control_codec import encode_job, encode_message, split_frames
+from telemetry import Profiler
+from simulator import SimScheduler, Simulation, SimJob, synthetic_mix
+
+MB = 1024 * 1024
+
+# Fixed workloads: (jobs, steps, compute spec, payload spec in MB, Scheduler kwargs, wire format or None)
+CASES = {
+    "priority": (1000, 5, "exp:0.05", "choice:0.1,1,10", {}, None),
+    "priority_json": (1000, 5, "exp:0.05", "choice:0.1,1,10", {}, "json"),
+    "priority_binary": (1000, 5, "exp:0.05", "choice:0.1,1,10", {}, "binary"),
+    "chunked": (200, 10, "exp:0.02", "choice:1,10,50", {"max_concurrent": 2, "chunk_bytes": MB}, None),
+    "leases": (4, 200, "uniform:0.02,0.1", "const:1", {"lease_steps": 4, "max_concurrent": 3}, None),
+    "aging": (500, 5, "exp:0.02", "choice:0.1,1,10", {"policy": "aging", "max_wait": 0.5}, None),
+    "wfq": (500, 5, "exp:0.02", "choice:0.1,1,10", {"policy": "wfq", "max_concurrent": 4}, None),
+}
+
+class BenchScheduler(SimScheduler):
+    """SimScheduler that times every process_message call and records what it sends.
+
+    With a `wire` format ("json" or "binary"), each message is decoded from
+    its wire form inside the timed region and replies are encoded the way
+    the Scheduler would send them, so framing cost is part of the
+    measurement. In binary, a job's first message also carries its JOB frame.
+    """
+
+    def __init__(self, sim, beta, wire=None, **kwargs):
+        super().__init__(sim, beta, **kwargs)
+        self.wire = wire
+        self.names = {} # job number -> job_id, for binary
+        self.latency = [] # ns per process_message
+        self.sent = [] # (job_id, msg) in order, hashed after the run
+
+    def process_message(self, sock, msg):
+        if self.wire == "json":
+            buf = bytearray((json.dumps(msg) + "\n").encode("utf-8"))
+            start = time.perf_counter_ns()
+            for m in split_messages(buf):
+                super().process_message(sock, m)
+        elif self.wire == "binary":
+            state = self.job_states.get(sock)
+            if state is None:
+                num = len(self.names)
+                buf = bytearray(encode_job(num, sock, msg.get("profile")) + encode_message(num, msg))
+            else:
+                buf = bytearray(encode_message(state.num, msg))
+            start = time.perf_counter_ns()
+            for frame in split_frames(buf):
+                self.process_frame(sock, self.names, frame)
+        else:
+            start = time.perf_counter_ns()
+            super().process_message(sock, msg)
+        self.latency.append(time.perf_counter_ns() - start)
+        # Replies the job sends in response (RELEASE) arrive after this message
+        while self.sim.outbox:
+            self.process_message(*self.sim.outbox.pop(0))
+
+    def decisions(self):
+        """Digest of everything sent, in order: equal digests mean equal scheduling."""
+        return hashlib.sha256(json.dumps(self.sent, sort_keys=True).encode()).hexdigest()[:16]
+
+    def send_to(self, state, msg):
+        if self.wire == "json":
+            (json.dumps(msg) + "\n").encode("utf-8")
+        elif self.wire == "binary":
+            encode_message(state.num, msg)
+        self.sent.append((state.sock, msg))
+        self.sim.deliver(state.sock, msg)
+
+class BenchSimulation(Simulation):
+    """Simulation whose jobs also follow the lease protocol the way worker.py does.
+
+    A job spends lease credit without asking (and reports SPENT), and answers
+    REVOKE with RELEASE once any transfer in progress is done.
+    """
+
+    scheduler_class = BenchScheduler
+
+    def __init__(self, jobs, beta, **sched_kwargs):
+        self.outbox = [] # (job_id, msg) sent by jobs while the scheduler was busy
+        self.credit = {} # {job_id: lease bytes left}, leased jobs only
+        self.on_credit = set()
+        self.release_after = set()
+        super().__init__(jobs, beta, **sched_kwargs)
+
+    def deliver(self, job_id, msg):
+        cmd = msg["command"]
+        if cmd == "ALLOW_SEND":
+            if "credit" in msg:
+                self.credit[job_id] = msg["credit"]
+            self.start_transfer(job_id, msg.get("bytes"))
+        elif cmd == "CREDIT":
+            if job_id in self.credit:
+                self.credit[job_id] += msg["bytes"]
+        elif cmd == "REVOKE":
+            if self.credit.pop(job_id, None) is not None:
+                if job_id in self.active:
+                    self.release_after.add(job_id)
+                else:
+                    self.outbox.append((job_id, {"job_id": job_id, "status": "RELEASE"}))
+
+    def _compute_done(self, job_id):
+        job = self.jobs[job_id]
+        payload = job.steps[job.step][1]
+        if self.credit.get(job_id, 0) >= payload:
+            self.on_credit.add(job_id)
+            self.start_transfer(job_id, None)
+            return
+        # Out of credit: the request ends the lease
+        self.credit.pop(job_id, None)
+        super()._compute_done(job_id)
+
+    def _transfer_done(self, job_id):
+        job = self.jobs[job_id]
+        compute_time, payload = job.steps[job.step]
+        if job_id in self.on_credit:
+            self.on_credit.discard(job_id)
+            del self.active[job_id]
+            comm_time = self.now - job.grant_start
+            self.sched.process_message(job_id, {"job_id": job_id, "status": "SPENT", "comm_time": comm_time,
+                                                "compute_time": compute_time, "payload_size": payload})
+            job.step += 1
+            if job.step < len(job.steps):
+                self._compute(job)
+            else:
+                job.jct = self.now
+        else:
+            super()._transfer_done(job_id)
+        if job.offset == 0 and job_id in self.credit:
+            self.credit[job_id] -= payload
+        if job_id in self.release_after and job_id not in self.active:
+            self.release_after.discard(job_id)
+            self.sched.process_message(job_id, {"job_id": job_id, "status": "RELEASE"})
+
+def run_case(name, seed=0, beta=0.5, profiler=None):
+    jobs, steps, compute, payload_mb, kwargs, wire = CASES[name]
+    mix = synthetic_mix(jobs, steps, compute, payload_mb, seed)
+    sim = BenchSimulation([SimJob(j, s) for j, s in mix], beta, wire=wire, **kwargs)
+    # Collector pauses land on whichever message triggers them; keep them out of the numbers
+    gc.collect()
+    gc.disable()
+    try:
+        if profiler:
+            # The whole replay is one section: simulator functions show up next to the scheduler's
+            profiler.start()
+            profiler.call(sim.run)
+            profiler.stop()
+        else:
+            sim.run()
+    finally:
+        gc.enable()
+    return np.array(sim.sched.latency, dtype=np.int64), sim.sched.decisions()
+
+def reference_ns():
+    """Time a fixed pure-Python workload (dicts, a heap, JSON) to gauge how fast this machine is right now."""
+    rng = random.Random(0)
+    states, heap = {}, []
+    start = time.perf_counter_ns()
+    for i in range(5000):
+        state = states[i % 512] = {"P": rng.random(), "step": i}
+        heapq.heappush(heap, (state["P"], i))
+        if len(heap) > 256:
+            heapq.heappop(heap)
+        json.dumps(state)
+    return time.perf_counter_ns() - start
+
+def replay(runs, names, repeats, seed):
+    """Replay each case `repeats` more times, appending (latencies, relative latencies, decisions) to runs[name].
+
+    Replays of different cases are interleaved so a slow spell hits them
+    all once instead of one case every time. Shared machines also change
+    speed for seconds at a time, so each replay is bracketed by
+    reference_ns() runs and its latencies are also kept in units of that
+    reference.
+    """
+    for _ in range(repeats):
+        for name in names:
+            before = reference_ns()
+            lat, decisions = run_case(name, seed)
+            ref = (before + reference_ns()) / 2
+            runs[name].append((lat, lat / ref, decisions))
+
+def summarize(name, runs):
+    """Per-message cost of one case over its replays.
+
+    Every replay sends the same messages in the same order, so message i
+    costs the same each time apart from interference; its minimum over the
+    replays is kept. `msgs_per_ref` (messages handled in the time of one
+    reference run) and `p50_ref` are what compare() uses.
+    """
+    if len({d for _, _, d in runs}) != 1:
+        raise RuntimeError(f"{name}: scheduling decisions differ between identical runs")
+    lat = np.min([l for l, _, _ in runs], axis=0)
+    rel = np.min([l for _, l, _ in runs], axis=0)
+    return {"msgs": len(lat), "msgs_per_s": len(lat) / (lat.sum() / 1e9),
+            "p50_us": float(np.percentile(lat, 50)) / 1e3, "p99_us": float(np.percentile(lat, 99)) / 1e3,
+            "msgs_per_ref": len(rel) / rel.sum(), "p50_ref": float(np.percentile(rel, 50)),
+            "decisions": runs[0][2]}
+
+def compare(res, base, threshold):
+    """Problems with `res` against baseline `base` for one case, and the change in normalized throughput."""
+    problems = []
+    if res["decisions"] != base["decisions"] or res["msgs"] != base["msgs"]:
+        problems.append("scheduling decisions changed")
+    thr = res["msgs_per_ref"] / base["msgs_per_ref"] - 1
+    p50 = res["p50_ref"] / base["p50_ref"] - 1
+    if thr < -threshold:
+        problems.append(f"throughput {thr:+.1%}")
+    if p50 > threshold:
+        problems.append(f"p50 {p50:+.1%}")
+    return problems, thr
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay fixed control-message workloads against the scheduler in-process and "
+                    "compare per-message cost with a saved baseline")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=list(CASES))
+    parser.add_argument("--repeats", type=int, default=5, help="Replays per case; each message's fastest replay counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", type=str, default=os.path.normpath(os.path.join(ROOT, "results", "bench_baseline.json")))
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Flag a drop in normalized throughput or a rise in normalized p50 larger than this fraction")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="Rounds of extra replays for cases that look slower than the baseline before flagging them")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="After timing, run each case once more under the profiler and append "
+                             "per-function cost to this file")
+    args = parser.parse_args()
+
+    base = None
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            base = json.load(f)
+
+    runs = {name: [] for name in args.cases}
+    replay(runs, args.cases, args.repeats, args.seed)
+    results = {name: summarize(name, r) for name, r in runs.items()}
+    for _ in range(args.retries if base else 0):
+        # More replays only lower the minima, so noise fades and a real slowdown stays
+        suspects = [name for name, res in results.items() if name in base["cases"]
+                    and res["decisions"] == base["cases"][name]["decisions"]
+                    and compare(res, base["cases"][name], args.threshold)[0]]
+        if not suspects:
+            break
+        print(f"Re-measuring {', '.join(suspects)}", flush=True)
+        replay(runs, suspects, args.repeats, args.seed)
+        results.update({name: summarize(name, runs[name]) for name in suspects})
+
+    failed = False
+    print(f"{'case':<16} {'msgs':>7} {'msgs/s':>10} {'p50 us':>8} {'p99 us':>8} {'decisions':>17}  vs baseline")
+    for name, res in results.items():
+        line = (f"{name:<16} {res['msgs']:>7} {res['msgs_per_s']:>10.0f} {res['p50_us']:>8.1f} "
+                f"{res['p99_us']:>8.1f} {res['decisions']:>17}  ")
+        if base and name in base["cases"]:
+            problems, thr = compare(res, base["cases"][name], args.threshold)
+            failed |= bool(problems)
+            line += "REGRESSION: " + ", ".join(problems) if problems else f"ok ({thr:+.1%} normalized msgs/s)"
+        else:
+            line += "-"
+        print(line, flush=True)
+
+    if args.profile:
+        profiler = Profiler(args.profile)
+        for name in args.cases:
+            with open(args.profile, "a") as f:
+                f.write(f"# case {name}\n")
+            run_case(name, args.seed, profiler=profiler)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.node(),
+                       "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "cases": {k: {f: v[f] for f in ("msgs", "msgs_per_s", "p50_us", "p99_us", "msgs_per_ref",
+                                                     "p50_ref", "decisions")}
+                                 for k, v in results.items()}}, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif base is None:
+        print(f"No baseline at {args.baseline}; run with --save to create one")
+    sys.exit(1 if failed else 0)
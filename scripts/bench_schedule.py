@@ -0,0 +1,62 @@
+import time
+import random
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from scheduler import Scheduler
+
+class BenchScheduler(Scheduler):
+    """Scheduler with control messages going nowhere, for in-process runs."""
+
+    def send_to(self, state, msg):
+        pass
+
+class LinearScanScheduler(BenchScheduler):
+    """The original O(n) schedule_next, kept here as the baseline."""
+
+    def update_priority(self, job_id, state):
+        state.I = state.last_compute / max(state.last_comm, 1e-6)
+        state.P = self.beta * state.I
+
+    def schedule_next(self):
+        if self.active:
+            return
+        candidates = [jid for jid, s in self.job_states.items() if s.waiting]
+        if not candidates:
+            return
+        winner_id = max(candidates, key=lambda jid: self.job_states[jid].P)
+        self.active[winner_id] = 0
+        self.job_states[winner_id].waiting = False
+
+def run(cls, num_jobs, rounds, seed):
+    rng = random.Random(seed)
+    sched = cls(beta=1.0)
+    for j in range(num_jobs):
+        sched.process_message(None, {"job_id": j, "compute_time": rng.random(), "payload_size": 1})
+
+    # Each event is one FINISHED from the active sender plus its next request
+    events = rounds * num_jobs
+    start = time.perf_counter()
+    for _ in range(events):
+        jid = next(iter(sched.active))
+        sched.process_message(None, {"job_id": jid, "status": "FINISHED", "comm_time": rng.random()})
+        sched.process_message(None, {"job_id": jid, "compute_time": rng.random(), "payload_size": 1})
+    elapsed = time.perf_counter() - start
+    return events / elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="schedule_next scaling benchmark")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--rounds", type=int, default=2,
+                        help="Scheduling rounds per run (one round = every job sends once)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'jobs':>8} {'linear events/s':>16} {'heap events/s':>14} {'speedup':>8}")
+    for n in args.jobs:
+        # The linear baseline is quadratic per round; cap its work on large n
+        linear = run(LinearScanScheduler, n, 1 if n >= 1000 else args.rounds, args.seed)
+        heap = run(BenchScheduler, n, args.rounds, args.seed)
+        print(f"{n:>8} {linear:>16.0f} {heap:>14.0f} {heap / linear:>7.1f}x")
@@ -0,0 +1,36 @@
+import asyncio
+import argparse
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+from loadgen import run_load, format_result
+from run_experiment import start_scheduler
+
+def run_case(engine, jobs, args):
+    scheduler, control_port, data_port = start_scheduler(1.0, ["--engine", engine] + args.scheduler_args)
+    try:
+        return asyncio.run(run_load(jobs, args.steps, args.compute, args.payload_mb, seed=args.seed,
+                                    control_port=control_port, data_port=data_port))
+    finally:
+        scheduler.terminate()
+        scheduler.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scheduler scaling benchmark driven by src/loadgen.py")
+    parser.add_argument("--engines", nargs="+", default=["threads", "asyncio"])
+    parser.add_argument("--jobs", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--compute", type=str, default="exp:0.01")
+    parser.add_argument("--payload_mb", type=str, default="const:0.1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("scheduler_args", nargs=argparse.REMAINDER,
+                        help="Extra arguments passed to scheduler.py (after --)")
+    args = parser.parse_args()
+    if args.scheduler_args[:1] == ["--"]:
+        args.scheduler_args = args.scheduler_args[1:]
+
+    for engine in args.engines:
+        for jobs in args.jobs:
+            print(f"{engine:<8} " + format_result(run_case(engine, jobs, args)), flush=True)
@@ -1,5 +1,9 @@
 import os
 import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from fabrictestbed_extensions.fablib.fablib import FablibManager as fablib_manager
 
 # Configure FABRIC environment
@@ -14,7 +18,75 @@ os.environ['FABRIC_SLICE_PUBLIC_KEY_FILE'] = os.path.join(fab_dir, 'slice_key.pu
 os.environ['FABRIC_LOG_LEVEL'] = os.environ.get('FABRIC_LOG_LEVEL', 'INFO')
 os.environ['FABRIC_QUIET'] = 'True'
 
-def deploy_and_run(slice_name="crux_testbed"):
+CODE_DIRS = ['src', 'scripts']
+# CPU-only torch compatible with Python 3.8
+DEPS = ['pip3 install torch==2.0.1+cpu --index-url https://download.pytorch.org/whl/cpu',
+        'pip3 install numpy matplotlib']
+
+def content_hash(parts):
+    """sha256 over the given strings and the files under CODE_DIRS (sorted, no caches)."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode('utf-8'))
+    for top in CODE_DIRS:
+        for root, dirs, files in os.walk(top):
+            dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+            for name in sorted(files):
+                if name.endswith('.pyc'):
+                    continue
+                path = os.path.join(root, name)
+                h.update(path.encode('utf-8'))
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+    return h.hexdigest()
+
+def remote_output(node, command):
+    result = node.execute(command, quiet=True)
+    return result[0].strip() if result else ''
+
+def deploy_node(node, code_hash, deps_hash, force=False):
+    """Upload code and install dependencies unless the node already has this version."""
+    name = node.get_name()
+    if force or remote_output(node, 'cat crux_testbed/.code_hash 2>/dev/null') != code_hash:
+        print(f"  → {name}: uploading code")
+        node.upload_directory('src', 'crux_testbed/src')
+        node.upload_directory('scripts', 'crux_testbed/scripts')
+        node.execute(f'echo {code_hash} > crux_testbed/.code_hash')
+    else:
+        print(f"  → {name}: code up to date")
+
+    if force or remote_output(node, 'cat crux_testbed/.deps_hash 2>/dev/null') != deps_hash:
+        print(f"  → {name}: installing dependencies")
+        for cmd in DEPS:
+            node.execute(cmd)
+        node.execute(f'echo {deps_hash} > crux_testbed/.deps_hash')
+    else:
+        print(f"  → {name}: dependencies up to date")
+
+def wait_for(node, command, timeout, what, interval=2):
+    """Poll `command` on node until it prints something; return that output."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        out = remote_output(node, command)
+        if out:
+            return out
+        time.sleep(interval)
+    raise TimeoutError(f"{node.get_name()}: timed out after {timeout}s waiting for {what}")
+
+def wait_for_worker(node, job_id, timeout):
+    """Poll until the worker logs its final line, or fail fast if it exits without it."""
+    log = f'crux_testbed/worker_{job_id.lower()}.log'
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if remote_output(node, f"grep -m1 'Job {job_id}: done' {log}"):
+            return True
+        if not remote_output(node, f"pgrep -f '[w]orker.py --job_id {job_id}'"):
+            # Exited without its final line: crashed or killed
+            return bool(remote_output(node, f"grep -m1 'Job {job_id}: done' {log}"))
+        time.sleep(2)
+    return False
+
+def deploy_and_run(slice_name="crux_testbed", force=False, timeout=600):
     """
     Connect to existing FABRIC slice, deploy code, and run experiment.
     """
@@ -36,19 +108,16 @@ def deploy_and_run(slice_name="crux_testbed"):
     
     print("✓ Found all nodes")
     
-    # Upload code to nodes
+    # Upload code to nodes, all at once; nodes that already have this
+    # code / these dependencies (by content hash) are skipped
     print("\n📦 Deploying code to nodes...")
     
-    for node in [worker_a, worker_b, scheduler_c]:
-        print(f"  → {node.get_name()}")
-        
-        # Upload source code
-        node.upload_directory('src', 'crux_testbed/src')
-        node.upload_directory('scripts', 'crux_testbed/scripts')
-        
-        # Install dependencies (CPU-only torch compatible with Python 3.8)
-        node.execute('pip3 install torch==2.0.1+cpu --index-url https://download.pytorch.org/whl/cpu')
-        node.execute('pip3 install numpy matplotlib')
+    code_hash = content_hash([])
+    deps_hash = hashlib.sha256("\n".join(DEPS).encode('utf-8')).hexdigest()
+    nodes = [worker_a, worker_b, scheduler_c]
+    with ThreadPoolExecutor(max_workers=len(nodes)) as pool:
+        # list() re-raises the first failure
+        list(pool.map(lambda node: deploy_node(node, code_hash, deps_hash, force), nodes))
     
     print("✓ Code deployed to all nodes")
     
@@ -70,45 +139,50 @@ def deploy_and_run(slice_name="crux_testbed"):
     
     # Start scheduler on node C
     print("  → Starting scheduler on scheduler-c...")
-    scheduler_c.execute('cd crux_testbed && nohup python3 src/scheduler.py --beta 1.0 > scheduler.log 2>&1 &')
+    # A scheduler left over from an earlier run would hold the ports
+    scheduler_c.execute("pkill -f '[s]rc/scheduler.py' || true")
+    scheduler_c.execute('cd crux_testbed && rm -f scheduler.log scheduler.npz && nohup python3 src/scheduler.py --beta 1.0 --results scheduler.npz > scheduler.log 2>&1 &')
     
-    # Give scheduler time to start
-    import time
-    time.sleep(3)
+    # The scheduler prints "READY <control_port> <data_port>" once it is listening
+    ready = wait_for(scheduler_c, "grep -m1 '^READY' crux_testbed/scheduler.log", 60, "scheduler readiness")
+    print(f"  ✓ Scheduler ready ({ready})")
     
     # Start workers
     scheduler_ip = '192.168.10.12'  # From provisioning script
     
     print("  → Starting worker A...")
-    worker_a.execute(f'cd crux_testbed && nohup python3 src/worker.py --job_id A --scheduler_host {scheduler_ip} --receiver_host {scheduler_ip} --model_size 4096 --grad_mb 1 --steps 50 > worker_a.log 2>&1 &')
+    worker_a.execute(f'cd crux_testbed && rm -f worker_a.log worker_a.npz && nohup python3 src/worker.py --job_id A --results worker_a.npz --scheduler_host {scheduler_ip} --receiver_host {scheduler_ip} --model_size 4096 --grad_mb 1 --steps 50 > worker_a.log 2>&1 &')
     
     print("  → Starting worker B...")
-    worker_b.execute(f'cd crux_testbed && nohup python3 src/worker.py --job_id B --scheduler_host {scheduler_ip} --receiver_host {scheduler_ip} --model_size 128 --grad_mb 50 --steps 50 > worker_b.log 2>&1 &')
+    worker_b.execute(f'cd crux_testbed && rm -f worker_b.log worker_b.npz && nohup python3 src/worker.py --job_id B --results worker_b.npz --scheduler_host {scheduler_ip} --receiver_host {scheduler_ip} --model_size 128 --grad_mb 50 --steps 50 > worker_b.log 2>&1 &')
     
     print("✓ Experiment started")
     
-    # Wait for completion (adjust based on expected runtime)
-    print("\n⏳ Waiting for experiment to complete (estimated: 60 seconds)...")
-    time.sleep(60)
+    # Wait for both workers to finish, polling their logs
+    print(f"\n⏳ Waiting for workers to finish (up to {timeout}s)...")
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        done = dict(zip(["A", "B"], pool.map(lambda args: wait_for_worker(*args, timeout),
+                                            [(worker_a, "A"), (worker_b, "B")])))
+    for job_id, ok in done.items():
+        print(f"  {'✓' if ok else '✗'} Worker {job_id} {'finished' if ok else 'did not finish'}")
+    print(f"  Experiment took {time.time() - start:.0f}s")
     
     # Collect results
     print("\n📥 Collecting results...")
     
-    # Download log files (if they exist)
-    try:
-        worker_a.download_file('/home/ubuntu/crux_testbed/worker_a.log', 'worker_a.log')
-    except Exception as e:
-        print(f"  Warning: Could not download worker_a.log: {e}")
-    
-    try:
-        worker_b.download_file('/home/ubuntu/crux_testbed/worker_b.log', 'worker_b.log')
-    except Exception as e:
-        print(f"  Warning: Could not download worker_b.log: {e}")
-    
-    try:
-        scheduler_c.download_file('/home/ubuntu/crux_testbed/scheduler.log', 'scheduler.log')
-    except Exception as e:
-        print(f"  Warning: Could not download scheduler.log: {e}")
+    # The scheduler rewrites its results once a second; let it catch the last steps
+    time.sleep(2)
+
+    # Download logs and per-step results (if they exist); the .npz files go in
+    # results/ so scripts/analyze_results.py can read them as one run
+    os.makedirs("results", exist_ok=True)
+    for node, name in [(worker_a, "worker_a"), (worker_b, "worker_b"), (scheduler_c, "scheduler")]:
+        for remote, local in [(f"{name}.log", f"{name}.log"), (f"{name}.npz", f"results/{name}.npz")]:
+            try:
+                node.download_file(f'/home/ubuntu/crux_testbed/{remote}', local)
+            except Exception as e:
+                print(f"  Warning: Could not download {remote}: {e}")
     
     print("✓ Results download attempted")
     
@@ -120,7 +194,8 @@ def deploy_and_run(slice_name="crux_testbed"):
             "worker-b": str(worker_b.get_management_ip()),
             "scheduler-c": str(scheduler_c.get_management_ip())
         },
-        "status": "completed"
+        "status": "completed" if all(done.values()) else "incomplete",
+        "workers_finished": done
     }
     
     with open("experiment_results.json", "w") as f:
@@ -129,4 +204,11 @@ def deploy_and_run(slice_name="crux_testbed"):
     print("\n✅ Experiment complete! Check the artifacts for logs and results.")
 
 if __name__ == "__main__":
-    deploy_and_run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slice_name", type=str, default="crux_testbed")
+    parser.add_argument("--force", action="store_true",
+                        help="Upload and reinstall even if the nodes' content hashes match")
+    parser.add_argument("--timeout", type=int, default=600,
+                        help="Seconds to wait for the workers to finish")
+    args = parser.parse_args()
+    deploy_and_run(args.slice_name, args.force, args.timeout)
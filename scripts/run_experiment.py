@@ -3,53 +3,186 @@ import time
 import argparse
 import sys
 import os
+import re
+import csv
+import shlex
 import threading
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Job A: Compute heavy (large model), small comm
+# Job B: Comm heavy (small model), large comm
+JOB_MIX = [
+    ("A", 4096, 1),   # job_id, model_size, grad_mb
+    ("B", 128, 50),
+]
+
+STEP_RE = re.compile(r"Job (\S+): Step (\d+), Comp ([\d.]+)s, Comm ([\d.]+)s")
+DONE_RE = re.compile(r"Job (\S+): done, (\d+) steps in ([\d.]+)s")
+
+def start_scheduler(beta, extra_args=(), control_port=0, data_port=0, echo=None):
+    """Launch scheduler.py and block until it reports its bound ports.
+
+    Port 0 lets the scheduler pick free ports, so many instances can run on
+    one machine. Ports given in extra_args win, since argparse keeps the
+    last value. Returns (process, control_port, data_port).
+    """
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "src", "scheduler.py"), "--beta", str(beta),
+                             "--control_port", str(control_port), "--data_port", str(data_port)] + list(extra_args),
+                            stdout=subprocess.PIPE, text=True)
+    for line in proc.stdout:
+        if echo:
+            echo.write(line)
+            echo.flush()
+        if line.startswith("READY"):
+            _, control_port, data_port = line.split()
+            break
+    else:
+        raise RuntimeError("scheduler exited before becoming ready")
+
+    # Keep reading so the scheduler never blocks on a full pipe
+    def drain():
+        for line in proc.stdout:
+            if echo:
+                echo.write(line)
+
+    t = threading.Thread(target=drain)
+    t.daemon = True
+    t.start()
+    return proc, int(control_port), int(data_port)
+
+def start_worker(job_id, model_size, grad_mb, steps, control_port, data_port, stdout=None, env=None, extra_args=()):
+    return subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "src", "worker.py"),
+        "--job_id", job_id,
+        "--model_size", str(model_size),
+        "--grad_mb", str(grad_mb),
+        "--steps", str(steps),
+        "--control_port", str(control_port),
+        "--data_port", str(data_port)
+    ] + list(extra_args), stdout=stdout, text=True, env=env)
 
 def run_simulation():
     print("Starting Simulation...")
-    
+
     # 1. Start Scheduler
     print("Launching Scheduler...")
-    scheduler = subprocess.Popen([sys.executable, "src/scheduler.py", "--beta", "1.0"])
-    time.sleep(2) # Wait for scheduler to start
-    
+    scheduler, control_port, data_port = start_scheduler(1.0, control_port=5000, data_port=6000, echo=sys.stdout)
+
     # 2. Start Workers
-    # Job A: Compute heavy (large model), small comm
-    print("Launching Worker A...")
-    worker_a = subprocess.Popen([
-        sys.executable, "src/worker.py",
-        "--job_id", "A",
-        "--model_size", "4096", # More compute
-        "--grad_mb", "1",       # Less comm
-        "--steps", "50"
-    ])
-    
-    # Job B: Comm heavy (small model), large comm
-    print("Launching Worker B...")
-    worker_b = subprocess.Popen([
-        sys.executable, "src/worker.py",
-        "--job_id", "B",
-        "--model_size", "128",  # Less compute
-        "--grad_mb", "50",      # More comm
-        "--steps", "50"
-    ])
-    
+    workers = []
+    for job_id, model_size, grad_mb in JOB_MIX:
+        print(f"Launching Worker {job_id}...")
+        workers.append(start_worker(job_id, model_size, grad_mb, 50, control_port, data_port))
+
     # Wait for workers
-    worker_a.wait()
-    worker_b.wait()
-    
+    for w in workers:
+        w.wait()
+
     print("Workers finished.")
     scheduler.terminate()
     print("Experiment Complete.")
 
+def parse_worker_output(text):
+    """Summarize one worker's stdout into {job_id, steps, mean_comp, mean_comm, elapsed}."""
+    comps, comms = [], []
+    row = {}
+    for line in text.splitlines():
+        m = STEP_RE.match(line)
+        if m:
+            row["job_id"] = m.group(1)
+            comps.append(float(m.group(3)))
+            comms.append(float(m.group(4)))
+            continue
+        m = DONE_RE.match(line)
+        if m:
+            row["job_id"] = m.group(1)
+            row["elapsed"] = float(m.group(3))
+    row["steps"] = len(comps)
+    row["mean_comp"] = sum(comps) / len(comps) if comps else 0.0
+    row["mean_comm"] = sum(comms) / len(comms) if comms else 0.0
+    if row.get("elapsed"):
+        row["steps_per_s"] = row["steps"] / row["elapsed"]
+    return row
+
+def run_instance(config):
+    """Run one isolated experiment (scheduler + job mix on free ports) and return result rows."""
+    env = dict(os.environ)
+    if config["parallel"] > 1:
+        # Many instances share the machine; don't let each torch grab every core
+        env.setdefault("OMP_NUM_THREADS", "1")
+
+    scheduler_args, worker_args = list(config["scheduler_args"]), {}
+    if config["results_dir"]:
+        # One directory per experiment: analyze_results.py treats it as one run
+        run_dir = os.path.join(config["results_dir"], f"beta{config['beta']}_r{config['repeat']}")
+        os.makedirs(run_dir, exist_ok=True)
+        scheduler_args += ["--results", os.path.join(run_dir, "scheduler.npz")]
+        worker_args = {job_id: ["--results", os.path.join(run_dir, f"worker_{job_id}.npz")] for job_id, _, _ in JOB_MIX}
+
+    scheduler, control_port, data_port = start_scheduler(config["beta"], scheduler_args)
+    try:
+        workers = [start_worker(job_id, model_size, grad_mb, config["steps"], control_port, data_port,
+                                stdout=subprocess.PIPE, env=env, extra_args=worker_args.get(job_id, ()))
+                   for job_id, model_size, grad_mb in JOB_MIX]
+        outputs = [w.communicate()[0] for w in workers]
+    finally:
+        scheduler.terminate()
+        scheduler.wait()
+
+    rows = []
+    for w, out in zip(workers, outputs):
+        row = {"beta": config["beta"], "repeat": config["repeat"], "returncode": w.returncode}
+        row.update(parse_worker_output(out))
+        rows.append(row)
+    return rows
+
+def run_sweep(betas, repeats, steps, parallel, scheduler_args, out_path, results_dir=None):
+    configs = [{"beta": beta, "repeat": r, "steps": steps, "parallel": parallel, "scheduler_args": scheduler_args,
+                "results_dir": results_dir}
+               for beta in betas for r in range(repeats)]
+    print(f"Running {len(configs)} experiments, {parallel} at a time...")
+
+    start = time.time()
+    rows = []
+    with ProcessPoolExecutor(max_workers=parallel) as pool:
+        for result in pool.map(run_instance, configs):
+            rows.extend(result)
+    print(f"Sweep finished in {time.time() - start:.1f}s")
+
+    columns = ["beta", "repeat", "job_id", "steps", "mean_comp", "mean_comm", "elapsed", "steps_per_s", "returncode"]
+    print(" ".join(f"{c:>11}" for c in columns))
+    for row in rows:
+        print(" ".join(f"{row.get(c, ''):>11.4f}" if isinstance(row.get(c), float) else f"{str(row.get(c, '')):>11}"
+                       for c in columns))
+
+    if out_path:
+        with open(out_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Results written to {out_path}")
+
 def run_fabric():
     print("FABRIC mode not yet implemented in this script. Use provision_fabric.py to setup nodes first.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--mode", choices=["simulation", "fabric"], default="simulation")
+    parser.add_argument("--mode", choices=["simulation", "sweep", "fabric"], default="simulation")
+    parser.add_argument("--betas", type=str, default="0,0.25,0.5,0.75,1",
+                        help="Comma-separated beta values for --mode sweep")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per beta for --mode sweep")
+    parser.add_argument("--steps", type=int, default=50, help="Steps per worker for --mode sweep")
+    parser.add_argument("--parallel", type=int, default=os.cpu_count() or 1,
+                        help="Experiments run at once for --mode sweep")
+    parser.add_argument("--scheduler_args", type=str, default="",
+                        help="Extra scheduler.py arguments for --mode sweep, e.g. \"--chunk_mb 1\"")
+    parser.add_argument("--out", type=str, default="sweep_results.csv")
+    parser.add_argument("--results_dir", type=str, default=None,
+                        help="Have every experiment save per-step .npz results under this directory")
     args = parser.parse_args()
-    
+
     # Ensure we are in the root directory
     if not os.path.exists("src"):
         print("Error: Must run from project root.")
@@ -57,5 +190,8 @@ if __name__ == "__main__":
 
     if args.mode == "simulation":
         run_simulation()
+    elif args.mode == "sweep":
+        run_sweep([float(b) for b in args.betas.split(",")], args.repeats, args.steps, args.parallel,
+                  shlex.split(args.scheduler_args), args.out, args.results_dir)
     else:
         run_fabric()
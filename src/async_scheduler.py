@@ -0,0 +1,210 @@
+import asyncio
+import struct
+import time
+from utils import *
+from scheduler import Scheduler, report_verifier
+from control_codec import read_hello, encode_hello, split_frames
+from grad_codec import PayloadVerifier
+
+class ControlProtocol(asyncio.Protocol):
+    """One job's control connection, served from the scheduler's event loop."""
+
+    def __init__(self, sched):
+        self.sched = sched
+        self.buf = bytearray()
+        self.version = None # control protocol: None until known, 0 = JSON, else binary
+        self.names = {} # job number -> job_id, binary protocol only
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.sched.profiler.call(self.receive, data)
+
+    def receive(self, data):
+        self.buf += data
+        try:
+            if self.version is None:
+                self.version = read_hello(self.buf)
+                if self.version is None:
+                    return
+                if self.version:
+                    self.transport.write(encode_hello(self.version))
+            if self.version:
+                for frame in split_frames(self.buf):
+                    self.sched.process_frame(self.transport, self.names, frame)
+                return
+            msgs = split_messages(self.buf)
+        except ValueError:
+            self.transport.close()
+            return
+        if not msgs:
+            return
+        for msg in msgs:
+            self.sched.process_message(self.transport, msg)
+
+    def connection_lost(self, exc):
+        self.sched.connection_closed(self.transport)
+
+class LoopShmStream(ShmStream):
+    """Sink end of a ShmStream driven by the event loop: doorbells go through the transport."""
+
+    def __init__(self, transport, shm, ring_size):
+        super().__init__(None, shm, ring_size, creator=False)
+        self.transport = transport
+
+    def _ring(self):
+        self.transport.write(b"\x01")
+
+    def _wait(self):
+        # Only acks are written, and the worker reads each one before its next transfer
+        raise BlockingIOError("shared-memory ack ring full")
+
+    def close(self):
+        for view in (self.ctr, self.tx, self.rx):
+            view.release()
+        self.shm.close()
+
+class DataSinkProtocol(asyncio.BufferedProtocol):
+    """Drains length-prefixed bulk transfers straight into a scratch buffer."""
+
+    def __init__(self, sched):
+        self.sched = sched
+        self.view = memoryview(bytearray(SINK_CHUNK_SIZE))
+        self.header = bytearray()
+        self.hello = None # SHM_HELLO body being collected
+        self.shm = None
+        self.remaining = 0
+        self.length = 0
+        self.start = 0.0
+        self.verifier = PayloadVerifier() if sched.verify else None
+        self.transport = None
+        self.peer = None
+        self.sink = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info("peername")
+        self.sink = self.sched.open_sink(self.peer)
+
+    def transfer_done(self):
+        elapsed = time.time() - self.start
+        ack = ACK.pack(self.length, elapsed)
+        if self.shm:
+            self.shm.sendall(ack)
+        else:
+            self.transport.write(ack)
+        self.sched.record_goodput(self.sink, self.length, elapsed)
+
+    def get_buffer(self, sizehint):
+        return self.view
+
+    def buffer_updated(self, nbytes):
+        self.sched.profiler.call(self.drain, nbytes)
+
+    def drain(self, nbytes):
+        if self.shm:
+            # Doorbell: drain whatever the worker has put in the ring
+            while True:
+                view = self.shm._available()
+                if view is None:
+                    return
+                n = view.nbytes
+                self.parse(view)
+                view.release()
+                self.shm._consume(n)
+        elif self.hello is not None:
+            self.hello += self.view[:nbytes]
+            self.parse_hello()
+        else:
+            self.parse(self.view[:nbytes])
+
+    def parse(self, view):
+        pos = 0
+        nbytes = view.nbytes
+        while pos < nbytes:
+            if self.remaining:
+                take = min(self.remaining, nbytes - pos)
+                if self.verifier:
+                    self.verifier.feed(view[pos:pos + take])
+                self.remaining -= take
+                pos += take
+                if not self.remaining:
+                    self.transfer_done()
+            else:
+                take = min(8 - len(self.header), nbytes - pos)
+                self.header += view[pos:pos + take]
+                pos += take
+                if len(self.header) == 8:
+                    self.length = self.remaining = struct.unpack('!Q', self.header)[0]
+                    self.header.clear()
+                    if self.length == SHM_HELLO:
+                        # The worker waits for our reply, so nothing follows the hello yet
+                        self.length = self.remaining = 0
+                        self.hello = bytearray(view[pos:nbytes])
+                        self.parse_hello()
+                        return
+                    self.start = time.time()
+                    if not self.length:
+                        self.transfer_done()
+
+    def parse_hello(self):
+        if len(self.hello) < SHM_HELLO_BODY.size:
+            return
+        ring_size, n = SHM_HELLO_BODY.unpack_from(self.hello)
+        if len(self.hello) < SHM_HELLO_BODY.size + n:
+            return
+        name = bytes(self.hello[SHM_HELLO_BODY.size:SHM_HELLO_BODY.size + n]).decode('utf-8')
+        self.hello = None
+        shm = attach_shm(name)
+        if shm is None:
+            self.transport.write(b"\x00")
+            return
+        self.transport.write(b"\x01")
+        self.shm = LoopShmStream(self.transport, shm, ring_size)
+
+    def connection_lost(self, exc):
+        if self.shm:
+            self.shm.close()
+        self.sched.close_sink(self.peer, self.sink)
+        if self.verifier:
+            report_verifier(self.verifier)
+
+class AsyncScheduler(Scheduler):
+    """Scheduler serving every control and data connection from one event loop.
+
+    Speaks the same control protocols and bulk framing as the threaded
+    Scheduler. All state is touched only from the loop thread, so no lock is
+    taken on the message path.
+    """
+
+    def write(self, transport, data):
+        # Jobs are registered with their asyncio transport; write() never blocks
+        transport.write(data)
+
+    def on_cluster(self, cluster):
+        # The coordinator thread hands updates to the loop instead of taking a lock
+        self.loop.call_soon_threadsafe(self.set_cluster, cluster)
+
+    async def serve(self):
+        loop = self.loop = asyncio.get_running_loop()
+        ctrl_sock, data_sock = self.listen()
+        ctrl_sock.setblocking(False)
+        data_sock.setblocking(False)
+        ctrl = await loop.create_server(lambda: ControlProtocol(self), sock=ctrl_sock)
+        print(f"Scheduler Control listening on {self.control_port} (asyncio)")
+        data = await loop.create_server(lambda: DataSinkProtocol(self), sock=data_sock)
+        print(f"Data Sink listening on {self.data_port} (asyncio)")
+        self.announce_ready()
+        if self.coordinator:
+            self.join_cluster()
+
+        async with ctrl, data:
+            await asyncio.gather(ctrl.serve_forever(), data.serve_forever())
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,196 @@
+import struct
+
+# Binary control protocol: fixed-layout frames in place of JSON lines.
+#
+# It is negotiated per connection. A client that speaks it opens with
+# HELLO: a NUL byte, "CTL", the highest version it speaks and a newline.
+# A JSON message always starts with "{", so the scheduler can tell them
+# apart, and it answers with the same six bytes carrying the version it
+# will speak. An older scheduler fails to parse HELLO as JSON and drops
+# the connection; the client then reconnects and speaks JSON, as clients
+# that never send HELLO always do.
+#
+# Every frame starts with an opcode byte and a 16-bit job number. Job IDs
+# are interned per connection: the client announces each job once with
+# JOB (number, job_id, profile) and both sides then use the number.
+# Optional values travel as NaN (floats) or as a flag bit.
+
+CTRL_MAGIC = b"\x00CTL"
+CTRL_VERSION = 1
+HELLO_SIZE = len(CTRL_MAGIC) + 2
+
+# Worker -> scheduler
+OP_JOB = 1
+OP_REQUEST = 2
+OP_FINISHED = 3
+OP_SPENT = 4
+OP_CHUNK_DONE = 5
+OP_RELEASE = 6
+# Scheduler -> worker
+OP_ALLOW = 16
+OP_CREDIT = 17
+OP_REVOKE = 18
+OP_RATE = 19
+
+JOB = struct.Struct("!BHHH") # job_id length, profile length; both strings follow
+FRAMES = {
+    OP_REQUEST: struct.Struct("!BHdQB"), # compute_time, payload_size, flags
+    OP_FINISHED: struct.Struct("!BHdddd"), # comm_time, allow_latency, step_time, goodput
+    OP_SPENT: struct.Struct("!BHddQBdd"), # comm_time, compute_time, payload_size, flags, step_time, goodput
+    OP_CHUNK_DONE: struct.Struct("!BHQ"), # bytes
+    OP_RELEASE: struct.Struct("!BH"),
+    OP_ALLOW: struct.Struct("!BHBQQd"), # flags, bytes, credit, rate
+    OP_CREDIT: struct.Struct("!BHQ"), # bytes
+    OP_REVOKE: struct.Struct("!BH"),
+    OP_RATE: struct.Struct("!BHd"), # rate
+}
+F_OVERLAP = 1 # REQUEST/SPENT
+F_BYTES, F_CREDIT, F_RATE = 1, 2, 4 # ALLOW: which optional fields are set
+NAN = float("nan")
+
+def encode_hello(version=CTRL_VERSION):
+    return CTRL_MAGIC + bytes([version]) + b"\n"
+
+def parse_hello(data):
+    """Version from a HELLO, or None if `data` is not one."""
+    if len(data) != HELLO_SIZE or data[:len(CTRL_MAGIC)] != CTRL_MAGIC or data[-1:] != b"\n":
+        return None
+    return data[len(CTRL_MAGIC)]
+
+def read_hello(buf):
+    """Which protocol a new connection speaks, from the first bytes in `buf`.
+
+    Returns None until enough has arrived to tell, 0 for JSON (nothing is
+    consumed), or the binary version to answer with, after taking the
+    HELLO off the front of `buf`. Raises ValueError on a malformed HELLO.
+    """
+    if not buf:
+        return None
+    if buf[0] != CTRL_MAGIC[0]:
+        return 0
+    if len(buf) < HELLO_SIZE:
+        return None
+    version = parse_hello(bytes(buf[:HELLO_SIZE]))
+    if not version:
+        raise ValueError("malformed control protocol hello")
+    del buf[:HELLO_SIZE]
+    return min(version, CTRL_VERSION)
+
+def optional(x):
+    # NaN marks an absent optional float
+    return None if x != x else x
+
+def encode_job(num, job_id, profile):
+    name = str(job_id).encode("utf-8")
+    prof = profile.encode("utf-8") if profile is not None else b""
+    return JOB.pack(OP_JOB, num, len(name), len(prof)) + name + prof
+
+def encode_message(num, msg):
+    """Frame for a control message dict, for job number `num`."""
+    cmd = msg.get("command") or msg.get("status")
+    if cmd == "ALLOW_SEND":
+        flags = ("bytes" in msg) * F_BYTES | ("credit" in msg) * F_CREDIT | ("rate" in msg) * F_RATE
+        return FRAMES[OP_ALLOW].pack(OP_ALLOW, num, flags, msg.get("bytes", 0), msg.get("credit", 0),
+                                     msg.get("rate", 0.0))
+    if cmd == "FINISHED":
+        return FRAMES[OP_FINISHED].pack(OP_FINISHED, num, msg["comm_time"], msg.get("allow_latency", NAN),
+                                        msg.get("step_time", NAN), msg.get("goodput", NAN))
+    if cmd == "SPENT":
+        return FRAMES[OP_SPENT].pack(OP_SPENT, num, msg["comm_time"], msg["compute_time"], msg["payload_size"],
+                                     F_OVERLAP if msg.get("overlap") else 0, msg.get("step_time", NAN),
+                                     msg.get("goodput", NAN))
+    if cmd == "CHUNK_DONE":
+        return FRAMES[OP_CHUNK_DONE].pack(OP_CHUNK_DONE, num, msg["bytes"])
+    if cmd == "RELEASE":
+        return FRAMES[OP_RELEASE].pack(OP_RELEASE, num)
+    if cmd == "CREDIT":
+        return FRAMES[OP_CREDIT].pack(OP_CREDIT, num, msg["bytes"])
+    if cmd == "REVOKE":
+        return FRAMES[OP_REVOKE].pack(OP_REVOKE, num)
+    if cmd == "RATE":
+        return FRAMES[OP_RATE].pack(OP_RATE, num, msg["rate"])
+    if cmd is None and "compute_time" in msg:
+        return FRAMES[OP_REQUEST].pack(OP_REQUEST, num, msg["compute_time"], msg["payload_size"],
+                                       F_OVERLAP if msg.get("overlap") else 0)
+    raise ValueError(f"no binary frame for control message {cmd!r}")
+
+def decode_message(frame, job_id):
+    """Control message dict for a frame from split_frames(), as the JSON protocol would carry it."""
+    op = frame[0]
+    if op == OP_ALLOW:
+        _, _, flags, nbytes, credit, rate = frame
+        msg = {"command": "ALLOW_SEND", "job_id": job_id}
+        if flags & F_BYTES:
+            msg["bytes"] = nbytes
+        if flags & F_CREDIT:
+            msg["credit"] = credit
+        if flags & F_RATE:
+            msg["rate"] = rate
+        return msg
+    if op == OP_CREDIT:
+        return {"command": "CREDIT", "job_id": job_id, "bytes": frame[2]}
+    if op == OP_REVOKE:
+        return {"command": "REVOKE", "job_id": job_id}
+    if op == OP_RATE:
+        return {"command": "RATE", "job_id": job_id, "rate": frame[2]}
+    if op == OP_REQUEST:
+        _, _, compute_time, payload_size, flags = frame
+        msg = {"job_id": job_id, "compute_time": compute_time, "payload_size": payload_size}
+        if flags & F_OVERLAP:
+            msg["overlap"] = True
+        return msg
+    if op == OP_FINISHED:
+        msg = {"job_id": job_id, "status": "FINISHED", "comm_time": frame[2]}
+        for key, value in zip(("allow_latency", "step_time", "goodput"), frame[3:]):
+            if value == value:
+                msg[key] = value
+        return msg
+    if op == OP_SPENT:
+        _, _, comm_time, compute_time, payload_size, flags, step_time, goodput = frame
+        msg = {"job_id": job_id, "status": "SPENT", "comm_time": comm_time, "compute_time": compute_time,
+               "payload_size": payload_size}
+        if flags & F_OVERLAP:
+            msg["overlap"] = True
+        if step_time == step_time:
+            msg["step_time"] = step_time
+        if goodput == goodput:
+            msg["goodput"] = goodput
+        return msg
+    if op == OP_CHUNK_DONE:
+        return {"job_id": job_id, "status": "CHUNK_DONE", "bytes": frame[2]}
+    if op == OP_RELEASE:
+        return {"job_id": job_id, "status": "RELEASE"}
+    raise ValueError(f"no control message for opcode {op}")
+
+def split_frames(buf):
+    """Pop every complete frame off the front of a bytearray.
+
+    Returns a list of tuples as unpacked from the frame layout (opcode
+    first); JOB frames come back as (OP_JOB, num, job_id, profile). Raises
+    ValueError on an unknown opcode.
+    """
+    frames = []
+    pos, end = 0, len(buf)
+    while pos < end:
+        op = buf[pos]
+        layout = FRAMES.get(op)
+        if layout is not None:
+            if end - pos < layout.size:
+                break
+            frames.append(layout.unpack_from(buf, pos))
+            pos += layout.size
+        elif op == OP_JOB:
+            if end - pos < JOB.size:
+                break
+            _, num, n, m = JOB.unpack_from(buf, pos)
+            start = pos + JOB.size
+            if end - start < n + m:
+                break
+            job_id = bytes(buf[start:start + n]).decode("utf-8")
+            profile = bytes(buf[start + n:start + n + m]).decode("utf-8") or None
+            frames.append((OP_JOB, num, job_id, profile))
+            pos = start + n + m
+        else:
+            raise ValueError(f"unknown control opcode {op}")
+    del buf[:pos]
+    return frames
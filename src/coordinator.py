@@ -0,0 +1,113 @@
+import socket
+import threading
+import argparse
+from utils import *
+
+class Coordinator:
+    """Joins scheduler shards, each owning one link and data sink, into one cluster.
+
+    Shards register their control/data endpoints and periodically report
+    aggregates of their jobs' I and D. Each report is answered
+    with the cluster-wide view, which shards use to put P on one scale.
+    Workers ask the coordinator where to run; new jobs go to the shard whose
+    jobs are least degraded, so D stays balanced across links.
+    """
+
+    def __init__(self, port=COORDINATOR_PORT):
+        self.port = port
+        self.shards = {} # {shard_id: {host, control_port, data_port, jobs, sum_D, max_D, max_I, assigned}}
+        self.placement = {} # {job_id: shard_id}
+        self.lock = threading.Lock()
+
+    def handle_client(self, sock):
+        reader = MessageReader(sock)
+        while True:
+            msgs = reader.recv_many()
+            if not msgs:
+                break
+            with self.lock:
+                for msg in msgs:
+                    reply = self.process_message(msg)
+                    if reply is not None:
+                        send_json(sock, reply)
+        sock.close()
+
+    def process_message(self, msg):
+        cmd = msg.get("command")
+        if cmd == "REGISTER":
+            shard = self.shards.setdefault(msg["shard"], {"jobs": 0, "sum_D": 0.0, "max_D": 0.0, "max_I": 0.0,
+                                                          "assigned": 0})
+            shard.update(host=msg["host"], control_port=msg["control_port"], data_port=msg["data_port"])
+            print(f"Coordinator: shard {msg['shard']} at {msg['host']}:{msg['control_port']}")
+            return self.cluster_state()
+
+        elif cmd == "REPORT":
+            shard = self.shards.get(msg["shard"])
+            if shard is None:
+                return None
+            for key in ("jobs", "sum_D", "max_D", "max_I"):
+                shard[key] = msg[key]
+            return self.cluster_state()
+
+        elif cmd == "PLACE":
+            return self.place(msg["job_id"])
+
+    def cluster_state(self):
+        shards = list(self.shards.values())
+        jobs = sum(s["jobs"] for s in shards)
+        return {"command": "CLUSTER",
+                "shards": len(shards),
+                "jobs": jobs,
+                "mean_D": sum(s["sum_D"] for s in shards) / jobs if jobs else 0.0,
+                "max_D": max((s["max_D"] for s in shards), default=0.0),
+                "max_I": max((s["max_I"] for s in shards), default=0.0)}
+
+    def place(self, job_id):
+        """Pick (and remember) a shard for job_id: least mean D, then fewest jobs."""
+        if not self.shards:
+            return {"command": "PLACE", "error": "no shards registered"}
+        shard_id = self.placement.get(job_id)
+        if shard_id is None:
+            def load(item):
+                s = item[1]
+                return (s["sum_D"] / s["jobs"] if s["jobs"] else 0.0, s["assigned"])
+            shard_id = min(self.shards.items(), key=load)[0]
+            self.placement[job_id] = shard_id
+            self.shards[shard_id]["assigned"] += 1
+        s = self.shards[shard_id]
+        return {"command": "PLACE", "shard": shard_id, "host": s["host"],
+                "control_port": s["control_port"], "data_port": s["data_port"]}
+
+    def run(self):
+        s = make_listener(self.port)
+        self.port = s.getsockname()[1]
+        print(f"Coordinator listening on {self.port}")
+        print(f"READY {self.port}", flush=True)
+        while True:
+            conn, addr = s.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            t = threading.Thread(target=self.handle_client, args=(conn,))
+            t.daemon = True
+            t.start()
+
+def parse_addr(addr):
+    host, _, port = addr.rpartition(":")
+    return host or "localhost", int(port or COORDINATOR_PORT)
+
+def place_job(addr, job_id):
+    """Ask the coordinator at host:port which shard job_id should use."""
+    sock = socket.create_connection(parse_addr(addr))
+    try:
+        send_json(sock, {"command": "PLACE", "job_id": job_id})
+        reply = MessageReader(sock).recv()
+    finally:
+        sock.close()
+    if reply is None or "error" in reply:
+        raise RuntimeError(f"coordinator could not place job {job_id}: {reply and reply.get('error')}")
+    return reply
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coordinator for sharded schedulers")
+    parser.add_argument("--port", type=int, default=COORDINATOR_PORT)
+    args = parser.parse_args()
+    Coordinator(args.port).run()
@@ -0,0 +1,182 @@
+import struct
+import zlib
+
+# Wire format of a gradient payload (one bulk transfer):
+#   header: magic, version, codec, reserved, numel, count, scale, crc32(body)
+#   body:   codec-specific, see GradientPacker.pack
+HEADER = struct.Struct('!4sBBHQQfI')
+HEADER_SIZE = HEADER.size
+MAGIC = b"GRD1"
+VERSION = 1
+
+CODECS = {"none": 0, "fp16": 1, "int8": 2, "topk": 3}
+CODEC_NAMES = {v: k for k, v in CODECS.items()}
+
+def body_size(codec, numel, count):
+    if codec == "none":
+        return numel * 4
+    if codec == "fp16":
+        return numel * 2
+    if codec == "int8":
+        return numel
+    if codec == "topk":
+        return count * 8 # int32 index + fp32 value
+    raise ValueError(f"unknown codec {codec}")
+
+class GradientPacker:
+    """Keeps a model's gradients in one contiguous buffer and encodes it for the wire.
+
+    Every parameter's .grad is a view into a single flat float32 tensor, so
+    backward() writes gradients straight into the send buffer. With codec
+    "none" on CPU the payload is that buffer itself (zero copy); other codecs
+    encode into a caller-provided buffer in one pass.
+    """
+
+    def __init__(self, params, codec="none", topk_ratio=0.01):
+        import torch
+
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec}")
+        self.torch = torch
+        self.codec = codec
+        self.params = [p for p in params if p.requires_grad]
+        self.numel = sum(p.numel() for p in self.params)
+        self.count = max(1, int(self.numel * topk_ratio)) if codec == "topk" else self.numel
+        self.payload_size = HEADER_SIZE + body_size(codec, self.numel, self.count)
+
+        device = self.params[0].device
+        # Host-side float32 gradients live right after a header-sized gap
+        self.grad_buf = bytearray(HEADER_SIZE + self.numel * 4)
+        self.host = torch.frombuffer(self.grad_buf, dtype=torch.float32, count=self.numel, offset=HEADER_SIZE)
+        self.flat = self.host if device.type == "cpu" else torch.zeros(self.numel, device=device)
+
+        offset = 0
+        for p in self.params:
+            n = p.numel()
+            p.grad = self.flat[offset:offset + n].view_as(p)
+            offset += n
+
+        self.out = None if codec == "none" else self.new_buffer()
+
+    def new_buffer(self):
+        return bytearray(self.payload_size)
+
+    def zero_grad(self):
+        # Keeps the .grad views alive, unlike optimizer.zero_grad(set_to_none=True)
+        self.flat.zero_()
+
+    def pack(self, out=None):
+        """Encode the current gradients. Returns a memoryview of the payload.
+
+        Without `out`, codec "none" sends the gradient buffer in place and
+        other codecs reuse an internal buffer.
+        """
+        torch = self.torch
+        if self.flat is not self.host:
+            self.host.copy_(self.flat)
+
+        if out is None:
+            out = self.grad_buf if self.codec == "none" else self.out
+        scale = 1.0
+
+        if self.codec == "none":
+            if out is not self.grad_buf:
+                memoryview(out)[HEADER_SIZE:] = memoryview(self.grad_buf)[HEADER_SIZE:]
+        elif self.codec == "fp16":
+            torch.frombuffer(out, dtype=torch.float16, count=self.numel, offset=HEADER_SIZE).copy_(self.host)
+        elif self.codec == "int8":
+            amax = self.host.abs().max().item()
+            scale = amax / 127.0 if amax > 0 else 1.0
+            q = torch.frombuffer(out, dtype=torch.int8, count=self.numel, offset=HEADER_SIZE)
+            q.copy_(torch.round(self.host / scale).clamp_(-127, 127))
+        elif self.codec == "topk":
+            _, idx = torch.topk(self.host.abs(), self.count, sorted=False)
+            torch.frombuffer(out, dtype=torch.int32, count=self.count, offset=HEADER_SIZE).copy_(idx)
+            values = torch.frombuffer(out, dtype=torch.float32, count=self.count, offset=HEADER_SIZE + self.count * 4)
+            torch.index_select(self.host, 0, idx, out=values)
+
+        view = memoryview(out)[:self.payload_size]
+        crc = zlib.crc32(view[HEADER_SIZE:])
+        HEADER.pack_into(out, 0, MAGIC, VERSION, CODECS[self.codec], 0, self.numel, self.count, scale, crc)
+        return view
+
+def parse_header(buf):
+    """Return (codec, numel, count, scale, crc, body_len), or None if not a gradient payload."""
+    magic, version, codec_id, _, numel, count, scale, crc = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION or codec_id not in CODEC_NAMES:
+        return None
+    codec = CODEC_NAMES[codec_id]
+    return codec, numel, count, scale, crc, body_size(codec, numel, count)
+
+def decode(payload):
+    """Decode a complete gradient payload into a dense float32 NumPy array."""
+    import numpy as np
+
+    info = parse_header(payload)
+    if info is None:
+        raise ValueError("not a gradient payload")
+    codec, numel, count, scale, crc, body_len = info
+    body = memoryview(payload)[HEADER_SIZE:HEADER_SIZE + body_len]
+    if zlib.crc32(body) != crc:
+        raise ValueError("gradient payload checksum mismatch")
+
+    if codec == "none":
+        return np.frombuffer(body, dtype=np.float32).copy()
+    if codec == "fp16":
+        return np.frombuffer(body, dtype=np.float16).astype(np.float32)
+    if codec == "int8":
+        return np.frombuffer(body, dtype=np.int8).astype(np.float32) * scale
+    dense = np.zeros(numel, dtype=np.float32)
+    idx = np.frombuffer(body, dtype=np.int32, count=count)
+    dense[idx] = np.frombuffer(body, dtype=np.float32, count=count, offset=count * 4)
+    return dense
+
+class PayloadVerifier:
+    """Checks gradient payloads in a byte stream as it is drained.
+
+    Bytes can be fed at any granularity (whole transfers, scheduler-granted
+    chunks or socket reads); the checksum is computed incrementally, so the
+    sink never has to reassemble a payload. Streams that don't start with a
+    gradient header (synthetic payloads) are counted once and then ignored.
+    """
+
+    def __init__(self):
+        self.header = bytearray()
+        self.remaining = 0
+        self.expected_crc = 0
+        self.crc = 0
+        self.ok = 0
+        self.bad = 0
+        self.unverifiable = False
+
+    def feed(self, data):
+        view = memoryview(data)
+        while view.nbytes and not self.unverifiable:
+            if self.remaining:
+                take = min(self.remaining, view.nbytes)
+                self.crc = zlib.crc32(view[:take], self.crc)
+                self.remaining -= take
+                view = view[take:]
+                if not self.remaining:
+                    self._finish()
+                continue
+
+            take = min(HEADER_SIZE - len(self.header), view.nbytes)
+            self.header += view[:take]
+            view = view[take:]
+            if len(self.header) < HEADER_SIZE:
+                continue
+            info = parse_header(self.header)
+            self.header.clear()
+            if info is None:
+                self.unverifiable = True
+                return
+            self.expected_crc, self.remaining, self.crc = info[4], info[5], 0
+            if not self.remaining:
+                self._finish()
+
+    def _finish(self):
+        if self.crc == self.expected_crc:
+            self.ok += 1
+        else:
+            self.bad += 1
@@ -0,0 +1,165 @@
+import asyncio
+import argparse
+import json
+import random
+import struct
+import time
+from utils import *
+from telemetry import LatencyHistogram
+
+def parse_dist(spec):
+    """Parse a distribution spec into a sampler taking a random.Random.
+
+    Supported: const:X, uniform:LO,HI, exp:MEAN, lognormal:MU,SIGMA,
+    choice:A,B,... (uniform over the listed values).
+    """
+    kind, _, params = spec.partition(":")
+    vals = [float(v) for v in params.split(",") if v]
+    if kind == "const" and len(vals) == 1:
+        return lambda rng: vals[0]
+    if kind == "uniform" and len(vals) == 2:
+        return lambda rng: rng.uniform(vals[0], vals[1])
+    if kind == "exp" and len(vals) == 1:
+        return lambda rng: rng.expovariate(1.0 / vals[0])
+    if kind == "lognormal" and len(vals) == 2:
+        return lambda rng: rng.lognormvariate(vals[0], vals[1])
+    if kind == "choice" and vals:
+        return lambda rng: rng.choice(vals)
+    raise ValueError(f"bad distribution spec: {spec!r}")
+
+class LoadStats:
+    def __init__(self):
+        self.allow_latency = LatencyHistogram() # request -> first ALLOW_SEND
+        self.grants = 0
+        self.steps = 0
+        self.bytes_sent = 0
+
+async def connect_retry(host, port, sem):
+    async with sem:
+        while True:
+            try:
+                return await asyncio.open_connection(host, port)
+            except OSError:
+                await asyncio.sleep(0.2)
+
+async def run_job(job_id, compute_mean, payload_size, payload, steps, jitter, rng, stats, ready, start,
+                  host, receiver_host, control_port, data_port, sem):
+    reader, writer = await connect_retry(host, control_port, sem)
+    dreader, dwriter = await connect_retry(receiver_host, data_port, sem)
+    ready.release()
+    await start.wait()
+
+    view = payload[:payload_size]
+    profile = f"loadgen:{payload_size}"
+    for step in range(steps):
+        # "Compute": sleep for this job's mean compute time, +/- jitter
+        compute_time = compute_mean * rng.uniform(1 - jitter, 1 + jitter)
+        await asyncio.sleep(compute_time)
+
+        writer.write((json.dumps({"job_id": job_id, "compute_time": compute_time,
+                                  "payload_size": payload_size, "profile": profile}) + "\n").encode('utf-8'))
+        request_ts = time.perf_counter()
+        allow_latency = None
+        offset = 0
+        comm_time = 0.0
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            msg = json.loads(line)
+            if msg.get("command") != "ALLOW_SEND":
+                continue
+            if allow_latency is None:
+                allow_latency = time.perf_counter() - request_ts
+                stats.allow_latency.record(allow_latency)
+            stats.grants += 1
+
+            grant = msg.get("bytes", payload_size - offset)
+            start_comm = time.perf_counter()
+            dwriter.write(struct.pack('!Q', grant))
+            dwriter.write(view[offset:offset + grant])
+            await dwriter.drain()
+            # The sink acks every transfer once it has all of it
+            try:
+                await dreader.readexactly(ACK.size)
+            except asyncio.IncompleteReadError:
+                return
+            comm_time += time.perf_counter() - start_comm
+            stats.bytes_sent += grant
+            offset += grant
+            if offset >= payload_size:
+                break
+            writer.write((json.dumps({"job_id": job_id, "status": "CHUNK_DONE", "bytes": grant}) + "\n").encode('utf-8'))
+
+        writer.write((json.dumps({"job_id": job_id, "status": "FINISHED", "comm_time": comm_time,
+                                  "allow_latency": allow_latency}) + "\n").encode('utf-8'))
+        stats.steps += 1
+
+    writer.close()
+    dwriter.close()
+
+async def run_load(jobs=100, steps=20, compute="exp:0.01", payload_mb="const:1", jitter=0.1, seed=0,
+                   host="localhost", receiver_host=None, control_port=SCHEDULER_CONTROL_PORT,
+                   data_port=WORKER_DATA_PORT, connect_parallelism=64):
+    """Run `jobs` simulated jobs against a scheduler and return a results dict."""
+    rng = random.Random(seed)
+    compute_dist = parse_dist(compute)
+    payload_dist = parse_dist(payload_mb)
+    specs = [(max(0.0, compute_dist(rng)), max(0, int(payload_dist(rng) * 1024 * 1024))) for _ in range(jobs)]
+
+    # Every job sends a prefix of one shared zero buffer, so memory stays flat
+    payload = memoryview(bytes(max(size for _, size in specs)))
+    stats = LoadStats()
+    ready = asyncio.Semaphore(0)
+    start = asyncio.Event()
+    sem = asyncio.Semaphore(connect_parallelism)
+
+    tasks = [asyncio.ensure_future(run_job(f"sim{i}", c, size, payload, steps, jitter, random.Random(seed + i + 1),
+                                           stats, ready, start, host, receiver_host or host, control_port,
+                                           data_port, sem))
+             for i, (c, size) in enumerate(specs)]
+    for _ in range(jobs):
+        await ready.acquire()
+
+    # Measure only once every job is connected
+    t0 = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0
+
+    lat = stats.allow_latency
+    return {
+        "jobs": jobs,
+        "steps": stats.steps,
+        "elapsed_s": elapsed,
+        "decisions_per_s": stats.grants / elapsed,
+        "allow_p50_s": lat.percentile(50),
+        "allow_p99_s": lat.percentile(99),
+        "goodput_gbps": stats.bytes_sent * 8 / elapsed / 1e9,
+    }
+
+def format_result(r):
+    return (f"jobs {r['jobs']:>6}  steps {r['steps']:>7}  {r['elapsed_s']:7.2f}s  "
+            f"decisions/s {r['decisions_per_s']:9.0f}  ALLOW p50 {r['allow_p50_s'] * 1e3:8.3f}ms  "
+            f"p99 {r['allow_p99_s'] * 1e3:8.3f}ms  goodput {r['goodput_gbps']:6.2f} Gbit/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Torch-free synthetic jobs speaking the scheduler protocol")
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--compute", type=str, default="exp:0.01",
+                        help="Distribution of per-job mean compute time in seconds")
+    parser.add_argument("--payload_mb", type=str, default="const:1",
+                        help="Distribution of per-job payload size in MB")
+    parser.add_argument("--jitter", type=float, default=0.1,
+                        help="Per-step compute time varies by +/- this fraction")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scheduler_host", type=str, default="localhost")
+    parser.add_argument("--receiver_host", type=str, default=None)
+    parser.add_argument("--control_port", type=int, default=SCHEDULER_CONTROL_PORT)
+    parser.add_argument("--data_port", type=int, default=WORKER_DATA_PORT)
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load(args.jobs, args.steps, args.compute, args.payload_mb, args.jitter, args.seed,
+                                  args.scheduler_host, args.receiver_host, args.control_port, args.data_port))
+    print(format_result(result))
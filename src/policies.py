@@ -0,0 +1,67 @@
+class MaxPriority:
+    """Serve the waiting job with the highest P.
+
+    A policy turns a waiting job into its key in the scheduler's max-heap.
+    enqueue() runs when a job starts waiting (a request, or the rest of a
+    chunked transfer), granted() when it is admitted; with `rekey`, P
+    updates move a job that is already waiting.
+    """
+
+    name = "priority"
+    rekey = True
+
+    def __init__(self, sched):
+        self.sched = sched
+
+    def enqueue(self, job_id, state):
+        pass
+
+    def key(self, job_id, state):
+        return state.P
+
+    def granted(self, job_id, state, grant):
+        pass
+
+class Aging(MaxPriority):
+    """P plus aging_rate for every second spent waiting, so low-P jobs cannot starve.
+
+    All waiting jobs age at the same rate, so ordering by
+    P + rate * (now - request_ts) is ordering by P - rate * request_ts:
+    the key is fixed at enqueue time and the heap never needs re-keying as
+    time passes. request_ts is the step's request, so a chunked transfer
+    keeps its age when it re-queues between chunks.
+    """
+
+    name = "aging"
+
+    def key(self, job_id, state):
+        return state.P - self.sched.aging_rate * (state.request_ts - self.sched.start_ts)
+
+class WeightedFair(MaxPriority):
+    """Self-clocked weighted fair queuing over granted bytes, weighted by P.
+
+    Each wait gets a virtual finish tag max(vtime, the job's last tag) +
+    bytes / weight and the smallest tag goes first; vtime moves to each
+    admitted job's tag. Higher-P jobs get a larger share of the link, and
+    every job keeps a share.
+    """
+
+    name = "wfq"
+    rekey = False # the tag is fixed for the bytes it covers
+
+    def __init__(self, sched):
+        super().__init__(sched)
+        self.vtime = 0.0
+
+    def enqueue(self, job_id, state):
+        weight = max(state.P, 1e-3)
+        start = max(self.vtime, state.wfq_tag)
+        state.wfq_tag = start + self.sched.next_grant(state) / weight
+
+    def key(self, job_id, state):
+        return -state.wfq_tag
+
+    def granted(self, job_id, state, grant):
+        self.vtime = max(self.vtime, state.wfq_tag)
+
+POLICIES = {cls.name: cls for cls in (MaxPriority, Aging, WeightedFair)}
@@ -0,0 +1,88 @@
+class IndexedMaxHeap:
+    """Binary max-heap of keys with priorities that can be changed in place.
+
+    A position index maps each key to its slot, so push, update and remove
+    are all O(log n). Equal priorities come out in insertion order.
+    """
+
+    def __init__(self):
+        self.heap = [] # [priority, seq, key]
+        self.pos = {}  # key -> index in self.heap
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.pos
+
+    def push(self, key, priority):
+        """Insert key, or change its priority if it is already queued."""
+        if key in self.pos:
+            self.update(key, priority)
+            return
+        self.seq += 1
+        self.heap.append([priority, self.seq, key])
+        self.pos[key] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+
+    def update(self, key, priority):
+        i = self.pos[key]
+        old = self.heap[i][0]
+        self.heap[i][0] = priority
+        if priority > old:
+            self._sift_up(i)
+        elif priority < old:
+            self._sift_down(i)
+
+    def peek(self):
+        return self.heap[0][2] if self.heap else None
+
+    def remove(self, key):
+        i = self.pos.pop(key)
+        last = self.heap.pop()
+        if i == len(self.heap):
+            return
+        self.heap[i] = last
+        self.pos[last[2]] = i
+        self._sift_up(i)
+        self._sift_down(self.pos[last[2]])
+
+    def discard(self, key):
+        if key in self.pos:
+            self.remove(key)
+
+    def _before(self, a, b):
+        # Higher priority first, then earlier insertion
+        return a[0] > b[0] or (a[0] == b[0] and a[1] < b[1])
+
+    def _sift_up(self, i):
+        heap, pos = self.heap, self.pos
+        item = heap[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not self._before(item, heap[parent]):
+                break
+            heap[i] = heap[parent]
+            pos[heap[i][2]] = i
+            i = parent
+        heap[i] = item
+        pos[item[2]] = i
+
+    def _sift_down(self, i):
+        heap, pos = self.heap, self.pos
+        n = len(heap)
+        item = heap[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and self._before(heap[child + 1], heap[child]):
+                child += 1
+            if not self._before(heap[child], item):
+                break
+            heap[i] = heap[child]
+            pos[heap[i][2]] = i
+            i = child
+        heap[i] = item
+        pos[item[2]] = i
@@ -2,102 +2,690 @@ import socket
 import threading
 import time
 import argparse
-import select
+import json
+import os
+import signal
+import sys
+import numpy as np
 from utils import *
+from control_codec import *
+from priority_queue import IndexedMaxHeap
+from policies import POLICIES
+from grad_codec import PayloadVerifier
+from telemetry import EventTrace, LatencyHistogram, StepLog, Profiler, serve_stats
+from coordinator import parse_addr
+
+class JobState:
+    """What the scheduler tracks for one job.
+
+    Slotted rather than a dict: a scheduler serving thousands of jobs keeps
+    one per job, and attribute access is cheaper than a key lookup on every
+    message. `sock` is whatever replies go to (a socket, an asyncio
+    transport, or the job_id in the simulator); `num` is the job's number on
+    a binary-protocol connection, None for JSON.
+    """
+
+    __slots__ = ("sock", "num", "profile", "iso_thr", "curr_thr", "I", "D", "P", "waiting", "leased", "credit",
+                 "revoking", "rate", "goodput", "wfq_tag", "calib_n", "calib_best", "last_compute", "last_payload",
+                 "last_comm", "last_wait", "first_wait", "remaining", "overlap", "request_ts", "enqueue_ts",
+                 "hist_wait", "hist_comm", "hist_rtt")
+
+    def __init__(self, sock, profile=None, num=None):
+        self.sock = sock
+        self.num = num
+        self.profile = profile
+        self.iso_thr = 0.0 # Unknown until calibrated or loaded from a profile
+        self.curr_thr = 0.0
+        self.I = 0.0
+        self.D = 0.0
+        self.P = 0.0
+        self.waiting = False
+        self.leased = False # holds a multi-step credit lease
+        self.credit = 0 # lease bytes the worker has left, as far as we know
+        self.revoking = False
+        self.rate = 0.0 # assigned send rate in bytes/s (with link_rate)
+        self.goodput = 0.0 # sink-measured, as reported by the worker
+        self.wfq_tag = 0.0 # virtual finish time, for policy "wfq"
+        self.calib_n = 0 # isolated step times seen during calibration, and the fastest
+        self.calib_best = float("inf")
+        self.last_compute = 0.0 # the current step, as last reported
+        self.last_payload = 0
+        self.last_comm = 1e-6
+        self.last_wait = 0.0 # request -> ALLOW, summed over chunks
+        self.first_wait = None # request -> first ALLOW
+        self.remaining = 0 # payload bytes not yet granted
+        self.overlap = False
+        self.request_ts = 0.0 # when the current step's request arrived, kept across its chunks
+        self.enqueue_ts = 0.0 # when the job last started waiting
+        self.hist_wait = LatencyHistogram() # request -> ALLOW, per step
+        self.hist_comm = LatencyHistogram() # reported comm time
+        self.hist_rtt = LatencyHistogram() # worker-seen ALLOW latency minus our wait
 
 class Scheduler:
-    def __init__(self, beta):
+    def __init__(self, beta, sock_buf=SOCKET_BUFFER_SIZE, calib_steps=3, ewma_alpha=0.3, profile_cache=None,
+                 max_concurrent=1, inflight_bytes=0, chunk_bytes=0, verify=False, trace=None,
+                 lease_steps=0, link_gbps=0.0, clock=time.time, control_port=SCHEDULER_CONTROL_PORT, data_port=WORKER_DATA_PORT,
+                 coordinator=None, shard_id=None, advertise_host=None, report_interval=1.0, results=None,
+                 policy="priority", aging_rate=1.0, max_wait=0.0):
         self.beta = beta
-        self.job_states = {} # {job_id: {iso_thr, curr_thr, I, D, P, socket}}
+        self.clock = clock # wall clock, or simulated time in the simulator
+        self.sock_buf = sock_buf
+        self.control_port = control_port
+        self.data_port = data_port
+        self.calib_steps = calib_steps
+        self.ewma_alpha = ewma_alpha
+        self.profile_cache = profile_cache
+        self.profiles = load_profiles(profile_cache) # {profile: iso_thr}
+        self.max_concurrent = max_concurrent # senders allowed on the link at once
+        self.inflight_budget = inflight_bytes # total bytes in flight, 0 = no limit
+        self.chunk_bytes = chunk_bytes # grant size for preemptible transfers, 0 = whole payload
+        self.verify = verify # checksum gradient payloads in the data sink
+        self.lease_steps = lease_steps # steps of credit per lease, 0 = ask before every step
+        self.link_rate = link_gbps * 1e9 / 8 # bytes/s shared out among senders, 0 = ordering only
+        self.job_states = {} # {job_id: JobState}
+        self.waiting = IndexedMaxHeap() # waiting job_ids keyed by the policy (P by default)
+        self.aging_rate = aging_rate # priority gained per second waited, for policy "aging"
+        self.max_wait = max_wait # serve any job waiting longer than this first, 0 = no bound
+        self.wait_order = IndexedMaxHeap() # waiting job_ids, oldest request first, kept only with max_wait
         self.lock = threading.Lock()
-        self.active_sender = None
+        self.active = {} # {job_id: payload bytes in flight}
+        self.inflight = 0
         self.running = True
 
+        # Telemetry: event ring (only when tracing), counters, link occupancy
+        self.trace = trace
+        self.counters = {"messages": 0, "requests": 0, "grants": 0, "chunks": 0, "finished": 0,
+                         "bytes_granted": 0, "leases": 0, "spent": 0, "refills": 0, "revokes": 0, "overdue": 0}
+        self.start_ts = self.clock()
+        self.policy = POLICIES[policy](self)
+        self.busy_since = None
+        self.link_busy = 0.0
+        self.sinks = {} # {peer: {bytes, goodput}} per open data connection, measured by the sink
+        self.results = results # StepLog of every completed step, or None
+        self.profiler = Profiler("scheduler_profile.txt") # off until toggled by SIGUSR1 or PROFILE
+
+        # Sharded mode: this scheduler owns one link of a cluster run by coordinator.py
+        self.coordinator = coordinator # "host:port", None = standalone
+        self.shard_id = shard_id
+        self.advertise_host = advertise_host
+        self.report_interval = report_interval
+        self.cluster = None # latest cluster-wide aggregates from the coordinator
+        self.max_I = 0.0 # largest I of any job with a measured comm time, scales I when standalone
+
     def handle_control_client(self, sock):
-        while self.running:
-            msg = recv_json(sock)
-            if not msg:
-                break
-            
-            job_id = msg.get("job_id")
-            
+        buf = bytearray()
+        version = self.accept_hello(sock, buf)
+        if version == 0:
+            reader = MessageReader(sock)
+            reader.buf = buf
+            while self.running and self.profiler.call(self.handle_batch, sock, reader):
+                pass
+        elif version:
+            names = {} # job number -> job_id, for this connection
+            while self.running and self.profiler.call(self.handle_frames, sock, buf, names):
+                pass
+
+        with self.lock:
+            self.connection_closed(sock)
+
+    def accept_hello(self, sock, buf):
+        """Read until a new control connection shows its protocol, and answer a HELLO.
+
+        Returns the binary protocol version to speak, 0 for JSON, or None if
+        the connection closed or opened with garbage. Bytes read past the
+        HELLO stay in `buf`.
+        """
+        try:
+            version = read_hello(buf)
+            while version is None:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    return None
+                buf += chunk
+                version = read_hello(buf)
+            if version:
+                sock.sendall(encode_hello(version))
+        except (OSError, ValueError):
+            return None
+        return version
+
+    def handle_batch(self, sock, reader):
+        """Handle everything that arrived in one recv under a single lock; False at EOF."""
+        msgs = reader.recv_many()
+        if not msgs:
+            return False
+        with self.lock:
+            for msg in msgs:
+                self.process_message(sock, msg)
+        return True
+
+    def handle_frames(self, sock, buf, names):
+        """handle_batch() for a connection speaking the binary protocol; False at EOF or on a bad frame."""
+        try:
+            frames = split_frames(buf)
+            while not frames:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    return False
+                buf += chunk
+                frames = split_frames(buf)
             with self.lock:
-                if job_id not in self.job_states:
-                    self.job_states[job_id] = {
-                        "iso_thr": 1.0, # Placeholder, needs calibration phase
-                        "curr_thr": 0.0,
-                        "I": 0.0,
-                        "D": 0.0,
-                        "P": 0.0,
-                        "sock": sock,
-                        "waiting": False
-                    }
-                
-                state = self.job_states[job_id]
-                
-                if "status" in msg and msg["status"] == "FINISHED":
-                    # Job finished sending
-                    comm_time = msg["comm_time"]
-                    # Update throughput (simplified)
-                    # throughput = payload / (comp + comm)
-                    # We need to track total time.
-                    self.active_sender = None
-                    self.schedule_next()
-                
-                elif "compute_time" in msg:
-                    # Job wants to send
-                    state["waiting"] = True
-                    state["last_compute"] = msg["compute_time"]
-                    state["last_payload"] = msg["payload_size"]
-                    
-                    # Update Priority
-                    # I = compute / comm (use last comm time or small epsilon)
-                    last_comm = state.get("last_comm", 1e-6)
-                    state["I"] = msg["compute_time"] / max(last_comm, 1e-6)
-                    
-                    # D = (iso - curr) / iso
-                    # For now, let's just use I for P if beta=1
-                    state["P"] = self.beta * state["I"] # + (1-beta)*D
-                    
-                    self.schedule_next()
+                for frame in frames:
+                    self.process_frame(sock, names, frame)
+        except (OSError, ValueError):
+            return False
+        return True
 
-    def schedule_next(self):
-        if self.active_sender:
+    def connection_closed(self, sock):
+        # A worker that exits must not keep its slot, leased or not, nor be
+        # granted one later on a socket that is gone
+        for job_id, state in self.job_states.items():
+            if state.sock is not sock:
+                continue
+            if state.leased:
+                self.end_lease(job_id, state)
+            else:
+                self.release(job_id)
+            if state.waiting:
+                state.waiting = False
+                self.waiting.discard(job_id)
+                self.wait_order.discard(job_id)
+        self.schedule_next()
+
+    def process_message(self, sock, msg):
+        if msg.get("command") == "PROFILE":
+            # Operator toggle rather than a job: start/stop the profiler and say which
+            self.write(sock, (json.dumps({"command": "PROFILE", "running": self.profiler.toggle(),
+                                          "path": self.profiler.path}) + "\n").encode("utf-8"))
             return
+        job_id = msg.get("job_id")
+        self.counters["messages"] += 1
 
-        # Find waiting jobs
-        candidates = [jid for jid, s in self.job_states.items() if s["waiting"]]
-        if not candidates:
+        state = self.job_states.get(job_id)
+        if state is None:
+            state = self.job_states[job_id] = JobState(sock, msg.get("profile"))
+
+        status = msg.get("status")
+        if status == "CHUNK_DONE":
+            self.chunk_done(job_id, state)
+        elif status == "FINISHED":
+            self.finished(job_id, state, msg["comm_time"], msg.get("allow_latency"), msg.get("step_time"),
+                          msg.get("goodput"))
+        elif status == "SPENT":
+            self.spent(job_id, state, msg["comm_time"], msg["compute_time"], msg["payload_size"],
+                       msg.get("overlap", False), msg.get("step_time"), msg.get("goodput"))
+        elif status == "RELEASE":
+            self.released(job_id, state)
+        elif "compute_time" in msg:
+            self.request(job_id, state, msg["compute_time"], msg["payload_size"], msg.get("overlap", False))
+
+    def process_frame(self, sock, names, frame):
+        """process_message() for one binary frame; `names` maps the connection's job numbers to job_ids."""
+        op, num = frame[0], frame[1]
+        if op == OP_JOB:
+            job_id = names[num] = sys.intern(frame[2])
+            state = self.job_states.get(job_id)
+            if state is None:
+                self.job_states[job_id] = JobState(sock, frame[3], num)
+            else:
+                # Replies go out on the job's latest connection, under its number there
+                state.sock, state.num = sock, num
             return
+        job_id = names.get(num)
+        if job_id is None:
+            raise ValueError(f"control frame for unannounced job number {num}")
+        state = self.job_states[job_id]
+        self.counters["messages"] += 1
 
-        # Pick highest P
-        winner_id = max(candidates, key=lambda jid: self.job_states[jid]["P"])
-        
-        self.active_sender = winner_id
-        self.job_states[winner_id]["waiting"] = False
-        
-        # Send ALLOW
-        send_json(self.job_states[winner_id]["sock"], {"command": "ALLOW_SEND"})
-
-    def start_control_server(self):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((SCHEDULER_HOST, SCHEDULER_CONTROL_PORT))
-        s.listen(5)
-        print(f"Scheduler Control listening on {SCHEDULER_CONTROL_PORT}")
+        if op == OP_REQUEST:
+            self.request(job_id, state, frame[2], frame[3], bool(frame[4] & F_OVERLAP))
+        elif op == OP_FINISHED:
+            self.finished(job_id, state, frame[2], optional(frame[3]), optional(frame[4]), optional(frame[5]))
+        elif op == OP_SPENT:
+            self.spent(job_id, state, frame[2], frame[3], frame[4], bool(frame[5] & F_OVERLAP),
+                       optional(frame[6]), optional(frame[7]))
+        elif op == OP_CHUNK_DONE:
+            self.chunk_done(job_id, state)
+        elif op == OP_RELEASE:
+            self.released(job_id, state)
+        else:
+            raise ValueError(f"unexpected control opcode {op} from a worker")
+
+    def request(self, job_id, state, compute_time, payload_size, overlap):
+        # Job wants to send
+        if state.leased:
+            # Asking again means the worker's credit ran out
+            self.end_lease(job_id, state)
+        state.last_wait = 0.0
+        state.first_wait = None
+        self.counters["requests"] += 1
+        if self.trace:
+            self.trace.record("request", job_id, payload_size)
+        state.last_compute = compute_time
+        state.last_payload = payload_size
+        state.remaining = payload_size
+        state.overlap = overlap
+        state.request_ts = self.clock()
+        if not state.iso_thr and state.profile in self.profiles:
+            state.iso_thr = self.profiles[state.profile]
+        self.update_priority(job_id, state)
+        self.enqueue(job_id, state)
+        self.schedule_next()
+
+    def chunk_done(self, job_id, state):
+        # Chunk boundary: release the slot and compete again for the rest,
+        # so a higher-P job that arrived meanwhile goes first
+        self.counters["chunks"] += 1
+        if self.trace:
+            self.trace.record("chunk_done", job_id, self.active.get(job_id, 0))
+        state.remaining -= self.active.get(job_id, 0)
+        self.release(job_id)
+        self.enqueue(job_id, state)
+        self.schedule_next()
+
+    def finished(self, job_id, state, comm_time, allow_latency=None, step_time=None, goodput=None):
+        # Job finished sending
+        state.last_comm = comm_time
+        self.counters["finished"] += 1
+        if self.trace:
+            self.trace.record("finish", job_id, comm_time)
+        state.hist_comm.record(comm_time)
+        state.hist_wait.record(state.last_wait)
+        if goodput is not None:
+            state.goodput = goodput
+        if allow_latency is not None and state.first_wait is not None:
+            state.hist_rtt.record(max(0.0, allow_latency - state.first_wait))
+        step = self.update_throughput(state, comm_time, step_time)
+        self.record_step(job_id, state, comm_time, step, goodput)
+        self.update_priority(job_id, state)
+        if state.leased:
+            # The lease keeps the slot for the steps it covers
+            self.check_lease(job_id, state)
+        else:
+            self.release(job_id)
+        self.schedule_next()
+
+    def spent(self, job_id, state, comm_time, compute_time, payload_size, overlap=False, step_time=None,
+              goodput=None):
+        # A step sent on lease credit: request and FINISHED in one message
+        self.counters["spent"] += 1
+        if self.trace:
+            self.trace.record("spent", job_id, payload_size)
+        state.last_compute = compute_time
+        state.last_payload = payload_size
+        state.overlap = overlap
+        state.last_wait = 0.0
+        state.last_comm = comm_time
+        state.hist_comm.record(comm_time)
+        state.hist_wait.record(0.0)
+        if goodput is not None:
+            state.goodput = goodput
+        step = self.update_throughput(state, comm_time, step_time)
+        self.record_step(job_id, state, comm_time, step, goodput)
+        self.update_priority(job_id, state)
+        if state.leased:
+            state.credit -= payload_size
+            self.check_lease(job_id, state)
+            self.schedule_next()
+
+    def released(self, job_id, state):
+        # Worker gave up its lease after a REVOKE
+        if state.leased:
+            self.end_lease(job_id, state)
+            self.schedule_next()
+
+    def enqueue(self, job_id, state):
+        state.waiting = True
+        state.enqueue_ts = self.clock()
+        self.policy.enqueue(job_id, state)
+        self.waiting.push(job_id, self.policy.key(job_id, state))
+        if self.max_wait:
+            # A chunk re-enqueued mid-transfer keeps its request's age
+            self.wait_order.push(job_id, -state.request_ts)
+
+    def update_throughput(self, state, comm_time, step_time=None):
+        compute = state.last_compute
+        wait = state.last_wait
+        if state.overlap:
+            # Pipelined workers hide comm behind the next step's compute
+            iso_step = max(compute, comm_time)
+            step = step_time or max(compute, wait + comm_time)
+        else:
+            # Isolated step: compute + comm with the link to ourselves (no wait)
+            iso_step = compute + comm_time
+            # Observed step additionally includes the time spent waiting for ALLOW
+            step = step_time or iso_step + wait
+
+        thr = 1.0 / max(step, 1e-6)
+        if state.curr_thr:
+            thr = ewma(state.curr_thr, thr, self.ewma_alpha)
+        state.curr_thr = thr
+
+        if state.iso_thr:
+            # The first steps include warm-up (torch, caches), so a later step
+            # that beats the calibrated time shows the isolated rate is higher.
+            # Contention only slows iso_step, so it can never raise it wrongly.
+            if 1.0 / max(iso_step, 1e-6) > state.iso_thr:
+                self.set_iso_thr(state, 1.0 / max(iso_step, 1e-6))
+        else:
+            # Calibration: every ALLOW is an exclusive slot on the link, so
+            # the fastest compute + comm seen is the isolated step time
+            state.calib_n += 1
+            state.calib_best = min(state.calib_best, iso_step)
+            if state.calib_n >= self.calib_steps:
+                self.set_iso_thr(state, 1.0 / max(state.calib_best, 1e-6))
+        return step
+
+    def set_iso_thr(self, state, iso_thr):
+        state.iso_thr = iso_thr
+        if state.profile is not None:
+            self.profiles[state.profile] = iso_thr
+            save_profiles(self.profile_cache, self.profiles)
+
+    def record_step(self, job_id, state, comm_time, step, goodput=None):
+        if self.results is not None:
+            self.results.record(job_id, self.clock(), state.last_compute, state.last_wait,
+                                comm_time, step, state.last_payload, goodput or 0.0)
+
+    def results_meta(self):
+        """Run-level fields saved with the step log: config, link busy time, per-job isolated throughput."""
+        now = self.clock()
+        busy = self.link_busy + (now - self.busy_since if self.busy_since is not None else 0.0)
+        states = dict(self.job_states)
+        iso = [states[j].iso_thr if j in states else 0.0 for j in list(self.results.jobs)]
+        return {"beta": self.beta, "policy": self.policy.name, "link_gbps": self.link_rate * 8 / 1e9,
+                "max_concurrent": self.max_concurrent,
+                "lease_steps": self.lease_steps, "start": self.start_ts, "now": now, "busy": busy,
+                "iso_thr": np.array(iso)}
+
+    def update_priority(self, job_id, state):
+        # I = compute / comm (use last comm time or small epsilon)
+        state.I = state.last_compute / max(state.last_comm, 1e-6)
+        if state.hist_comm.total and state.I > self.max_I:
+            # A new largest I moves everyone's scale; this job is rescaled with the rest
+            self.max_I = state.I
+            self.rescale()
+            return
+
+        # D = (iso - curr) / iso, 0 while the job is still calibrating
+        if state.iso_thr and state.curr_thr:
+            state.D = max(0.0, (state.iso_thr - state.curr_thr) / state.iso_thr)
+
+        I, D = state.I, state.D
+        if self.cluster:
+            # Sharded: scale by the cluster-wide maxima so P means the same on every shard
+            I /= max(self.cluster["max_I"], I, 1e-6)
+            D /= max(self.cluster["max_D"], D, 1e-6)
+        else:
+            # Standalone: I by the largest measured I, so it is in [0,1] like D and
+            # beta trades one against the other. An unmeasured job counts as 1.
+            I = min(I / max(self.max_I, 1e-6), 1.0)
+        state.P = self.beta * I + (1 - self.beta) * D
+
+        # Re-key the job in place so picking a winner stays O(log n)
+        if state.waiting and self.policy.rekey:
+            self.waiting.push(job_id, self.policy.key(job_id, state))
+
+    def overdue(self):
+        """The waiting job with the oldest request, if that was max_wait or more ago."""
+        job_id = self.wait_order.peek()
+        if job_id is None:
+            return None
+        if self.clock() - self.job_states[job_id].request_ts < self.max_wait:
+            return None
+        return job_id
+
+    def schedule_next(self):
+        # Hand out send slots in priority order until a limit is hit
+        granted = []
+        while self.waiting:
+            # A job past the max-wait bound goes ahead of the policy's order
+            late = self.overdue() if self.max_wait else None
+            winner_id = late if late is not None else self.waiting.peek()
+            if not self.can_admit(winner_id):
+                break
+            self.waiting.remove(winner_id)
+            self.wait_order.discard(winner_id)
+            if late is not None:
+                self.counters["overdue"] += 1
+            state = self.job_states[winner_id]
+            state.waiting = False
+            wait = self.clock() - state.enqueue_ts
+            state.last_wait += wait
+            if state.first_wait is None:
+                state.first_wait = wait
+
+            grant = self.next_grant(state)
+            self.policy.granted(winner_id, state, grant)
+            if not self.active:
+                self.busy_since = self.clock()
+            self.active[winner_id] = grant
+            self.inflight += grant
+            self.counters["grants"] += 1
+            self.counters["bytes_granted"] += grant
+            if self.trace:
+                self.trace.record("allow", winner_id, grant)
+
+            # Send ALLOW; tagged, since several jobs may share one control connection
+            msg = {"command": "ALLOW_SEND", "job_id": winner_id}
+            if self.chunk_bytes:
+                msg["bytes"] = grant
+            if self.lease_steps and state.iso_thr and grant == state.remaining and not self.waiting:
+                # Nobody else is waiting: let the job send its next steps without asking
+                state.leased = True
+                state.credit = self.lease_steps * state.remaining
+                msg["credit"] = state.credit
+                state.credit -= grant
+                self.counters["leases"] += 1
+            granted.append((winner_id, msg))
+
+        if self.link_rate and self.active:
+            self.assign_rates([job_id for job_id, _ in granted])
+        for job_id, msg in granted:
+            state = self.job_states[job_id]
+            if self.link_rate:
+                msg["rate"] = state.rate
+            self.send_to(state, msg)
+
+        if self.waiting:
+            self.revoke_leases()
+
+    def assign_rates(self, granted):
+        """Split link_rate among the active senders in proportion to P."""
+        weights = {job_id: max(self.job_states[job_id].P, 1e-3) for job_id in self.active}
+        total = sum(weights.values())
+        for job_id, w in weights.items():
+            state = self.job_states[job_id]
+            rate = self.link_rate * w / total
+            changed = abs(rate - state.rate) > 0.05 * rate
+            state.rate = rate
+            # New grants carry their rate; running senders get an update if it moved
+            if changed and job_id not in granted:
+                self.send_to(state, {"command": "RATE", "job_id": job_id, "rate": rate})
+
+    def check_lease(self, job_id, state):
+        """Refill a lease while the link is uncontended, end it once spent."""
+        payload = state.last_payload
+        full = self.lease_steps * payload
+        if not state.revoking and not self.waiting and state.credit < full // 2:
+            # Top up early so the worker never has to stop and ask
+            self.send_to(state, {"command": "CREDIT", "job_id": job_id,
+                                 "bytes": full - state.credit})
+            state.credit = full
+            self.counters["refills"] += 1
+        elif state.credit < payload and not state.revoking:
+            # The worker sees the same balance and will request next step
+            self.end_lease(job_id, state)
+
+    def end_lease(self, job_id, state):
+        state.leased = False
+        state.revoking = False
+        state.credit = 0
+        self.release(job_id)
+
+    def revoke_leases(self):
+        # Leases only last while uncontended; hand arbitration back to P
+        for job_id in list(self.active):
+            state = self.job_states[job_id]
+            if state.leased and not state.revoking:
+                state.revoking = True
+                self.counters["revokes"] += 1
+                if self.trace:
+                    self.trace.record("revoke", job_id, state.credit)
+                self.send_to(state, {"command": "REVOKE", "job_id": job_id})
+
+    def next_grant(self, state):
+        remaining = state.remaining
+        if self.chunk_bytes:
+            return min(self.chunk_bytes, remaining)
+        return remaining
+
+    def release(self, job_id):
+        self.inflight -= self.active.pop(job_id, 0)
+        if not self.active and self.busy_since is not None:
+            self.link_busy += self.clock() - self.busy_since
+            self.busy_since = None
+
+    def render_stats(self):
+        """Plain-text snapshot of counters and per-job latency percentiles."""
+        now = self.clock()
+        uptime = now - self.start_ts
+        busy = self.link_busy + (now - self.busy_since if self.busy_since is not None else 0.0)
+        lines = [f"uptime_s {uptime:.3f}",
+                 f"policy {self.policy.name}",
+                 f"link_busy_fraction {busy / uptime if uptime else 0.0:.4f}",
+                 f"active {len(self.active)}",
+                 f"waiting {len(self.waiting)}",
+                 f"inflight_bytes {self.inflight}"]
+        lines += [f"{k} {v}" for k, v in self.counters.items()]
+        if self.cluster:
+            c = self.cluster
+            lines.append(f"cluster shards {c['shards']} jobs {c['jobs']} mean_D {c['mean_D']:.4f} "
+                         f"max_D {c['max_D']:.4f} max_I {c['max_I']:.4f}")
+        if self.trace:
+            lines.append(f"trace_events {self.trace.count}")
+            lines.append(f"trace_dropped {self.trace.dropped}")
+        lines.append("")
+        lines.append("job P I D iso_thr curr_thr wait_p50 wait_p90 wait_p99 wait_max comm_p50 comm_p99 rtt_p50 rtt_p99 "
+                     "goodput_mbps rate_mbps")
+        for job_id, st in list(self.job_states.items()):
+            w, c, r = st.hist_wait, st.hist_comm, st.hist_rtt
+            lines.append(f"{job_id} {st.P:.4f} {st.I:.4f} {st.D:.4f} {st.iso_thr:.4f} {st.curr_thr:.4f} "
+                         f"{w.percentile(50):.6f} {w.percentile(90):.6f} {w.percentile(99):.6f} {w.max:.6f} "
+                         f"{c.percentile(50):.6f} {c.percentile(99):.6f} "
+                         f"{r.percentile(50):.6f} {r.percentile(99):.6f} "
+                         f"{st.goodput * 8 / 1e6:.1f} {st.rate * 8 / 1e6:.1f}")
+        lines.append("")
+        lines.append("sink_connection bytes goodput_mbps")
+        for peer, sink in list(self.sinks.items()):
+            lines.append(f"{peer} {sink['bytes']} {sink['goodput'] * 8 / 1e6:.1f}")
+        return "\n".join(lines) + "\n"
+
+    def can_admit(self, job_id):
+        if not self.active:
+            return True
+        if len(self.active) >= self.max_concurrent:
+            return False
+        # Calibration needs the link to itself, in both directions
+        if not self.job_states[job_id].iso_thr:
+            return False
+        if any(not self.job_states[jid].iso_thr for jid in self.active):
+            return False
+        if self.inflight_budget:
+            return self.inflight + self.next_grant(self.job_states[job_id]) <= self.inflight_budget
+        return True
+
+    def send_to(self, state, msg):
+        if state.num is None:
+            self.write(state.sock, (json.dumps(msg) + "\n").encode("utf-8"))
+        else:
+            self.write(state.sock, encode_message(state.num, msg))
+
+    def write(self, sock, data):
+        sock.sendall(data)
+
+    def listen(self):
+        """Bind both listeners and record the actual ports (for port 0)."""
+        ctrl = make_listener(self.control_port)
+        data = make_listener(self.data_port, self.sock_buf)
+        self.control_port = ctrl.getsockname()[1]
+        self.data_port = data.getsockname()[1]
+        return ctrl, data
+
+    def announce_ready(self):
+        # Machine-readable readiness line for launchers (run_experiment.py)
+        print(f"READY {self.control_port} {self.data_port}", flush=True)
+
+    def join_cluster(self):
+        """Register this shard with the coordinator and report to it from a daemon thread."""
+        if self.shard_id is None:
+            self.shard_id = str(self.control_port)
+        sock = socket.create_connection(parse_addr(self.coordinator))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # By default, advertise the address we reach the coordinator from
+        host = self.advertise_host or sock.getsockname()[0]
+        send_json(sock, {"command": "REGISTER", "shard": self.shard_id, "host": host,
+                         "control_port": self.control_port, "data_port": self.data_port})
+        reader = MessageReader(sock)
+
+        def loop():
+            while True:
+                msg = reader.recv()
+                if msg is None:
+                    print(f"Shard {self.shard_id}: lost the coordinator, scheduling standalone")
+                    self.on_cluster(None)
+                    return
+                if msg.get("command") == "CLUSTER":
+                    self.on_cluster(msg)
+                time.sleep(self.report_interval)
+                send_json(sock, self.shard_report())
+
+        t = threading.Thread(target=loop)
+        t.daemon = True
+        t.start()
+
+    def on_cluster(self, cluster):
+        # Called from the coordinator thread
+        with self.lock:
+            self.set_cluster(cluster)
+
+    def set_cluster(self, cluster):
+        """Adopt a new cluster view (None = standalone) and put every P on its scale.
+
+        Waiting jobs are re-keyed too, so the heap never compares P values
+        scaled by different maxima.
+        """
+        old, self.cluster = self.cluster, cluster
+        if old and cluster and old["max_I"] == cluster["max_I"] and old["max_D"] == cluster["max_D"]:
+            return
+        self.rescale()
+
+    def rescale(self):
+        # Recompute every P after the scale changed; waiting jobs are re-keyed
+        for job_id, state in self.job_states.items():
+            self.update_priority(job_id, state)
+
+    def shard_report(self):
+        # Raw (unscaled) I and D; list() snapshots the dict in one step. Jobs
+        # with no comm time measured yet have a placeholder I and are left out.
+        states = list(self.job_states.values())
+        return {"command": "REPORT", "shard": self.shard_id, "jobs": len(states),
+                "sum_D": sum(st.D for st in states),
+                "max_D": max((st.D for st in states), default=0.0),
+                "max_I": max((st.I for st in states if st.hist_comm.total), default=0.0)}
+
+    def start_control_server(self, s):
+        print(f"Scheduler Control listening on {self.control_port}")
         
         while self.running:
             conn, addr = s.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             t = threading.Thread(target=self.handle_control_client, args=(conn,))
             t.daemon = True
             t.start()
 
-    def start_data_sink(self):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((SCHEDULER_HOST, WORKER_DATA_PORT))
-        s.listen(5)
-        print(f"Data Sink listening on {WORKER_DATA_PORT}")
+    def start_data_sink(self, s):
+        print(f"Data Sink listening on {self.data_port}")
         
         while self.running:
             conn, addr = s.accept()
@@ -107,24 +695,167 @@ class Scheduler:
             t.start()
 
     def drain_data(self, sock):
+        # Payloads are discarded, so one scratch buffer per connection is enough
+        scratch = bytearray(SINK_CHUNK_SIZE)
+        verifier = PayloadVerifier() if self.verify else None
+        peer = sock.getpeername()
+        sink = self.open_sink(peer)
         while self.running:
-            data = recv_bulk(sock)
-            if not data:
+            length = recv_bulk_header(sock)
+            if length is None:
+                break
+            if length == SHM_HELLO:
+                # Co-located worker: payloads come through shared memory from now on
+                sock = ShmStream.accept(sock) or sock
+                continue
+            start = time.time()
+            if not self.profiler.call(discard_exact, sock, scratch, length, verifier.feed if verifier else None):
                 break
-            # Data received
+            # Ack once the last byte is in, so the sender sees real completion
+            elapsed = time.time() - start
+            send_ack(sock, length, elapsed)
+            self.record_goodput(sink, length, elapsed)
+        if isinstance(sock, ShmStream):
+            sock.close()
+        self.close_sink(peer, sink)
+        if verifier:
+            report_verifier(verifier)
+
+    def open_sink(self, peer):
+        sink = {"bytes": 0, "goodput": 0.0}
+        self.sinks[f"{peer[0]}:{peer[1]}"] = sink
+        return sink
+
+    def close_sink(self, peer, sink):
+        # Only live connections are listed; a new one may already reuse the peer address
+        key = f"{peer[0]}:{peer[1]}"
+        if self.sinks.get(key) is sink:
+            del self.sinks[key]
+
+    def record_goodput(self, sink, nbytes, seconds):
+        sink["bytes"] += nbytes
+        # Tiny transfers finish within one segment and say nothing about bandwidth
+        if nbytes >= PACE_BURST and seconds > 0:
+            rate = nbytes / seconds
+            sink["goodput"] = ewma(sink["goodput"], rate, self.ewma_alpha) if sink["goodput"] else rate
+
+    def run(self):
+        ctrl, data = self.listen()
+        self.announce_ready()
+        if self.coordinator:
+            self.join_cluster()
+        t_ctrl = threading.Thread(target=self.start_control_server, args=(ctrl,))
+        t_data = threading.Thread(target=self.start_data_sink, args=(data,))
+
+        t_ctrl.start()
+        t_data.start()
+
+        t_ctrl.join()
+        t_data.join()
+
+def report_verifier(verifier):
+    if verifier.unverifiable:
+        print("Data Sink: connection carried non-gradient payloads, not verified")
+    else:
+        print(f"Data Sink: verified {verifier.ok} gradient payloads, {verifier.bad} bad")
+
+def load_profiles(path):
+    """Load cached isolated throughputs ({profile: iso_thr}) if the file exists."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_profiles(path, profiles):
+    if not path:
+        return
+    with open(path, "w") as f:
+        json.dump(profiles, f, indent=2)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--beta", type=float, default=1.0)
+    parser.add_argument("--control_port", type=int, default=SCHEDULER_CONTROL_PORT,
+                        help="Control port (0 = pick a free port, reported on the READY line)")
+    parser.add_argument("--data_port", type=int, default=WORKER_DATA_PORT,
+                        help="Data sink port (0 = pick a free port, reported on the READY line)")
+    parser.add_argument("--sock_buf_mb", type=float, default=SOCKET_BUFFER_SIZE / (1024 * 1024))
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--calib_steps", type=int, default=3,
+                        help="Steps per job used to measure isolated throughput")
+    parser.add_argument("--ewma_alpha", type=float, default=0.3,
+                        help="Smoothing factor for the online current-throughput estimate")
+    parser.add_argument("--profile_cache", type=str, default=None,
+                        help="JSON file of cached isolated throughputs keyed by job profile")
+    parser.add_argument("--max-concurrent", dest="max_concurrent", type=int, default=1,
+                        help="Maximum number of jobs allowed to send at once")
+    parser.add_argument("--inflight-bytes", dest="inflight_bytes", type=int, default=0,
+                        help="Budget of payload bytes in flight across senders (0 = no limit)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Checksum gradient payloads (worker --payload grads) in the data sink")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Append scheduler events (request/allow/chunk_done/finish) to this JSONL file")
+    parser.add_argument("--stats_port", type=int, default=0,
+                        help="Serve live counters and latency percentiles over HTTP on this port (0 = off)")
+    parser.add_argument("--chunk_mb", type=float, default=0,
+                        help="Grant transfers in chunks of this size so they can be preempted (0 = whole payload)")
+    parser.add_argument("--link_gbps", type=float, default=0,
+                        help="Link capacity to share among senders in proportion to P; "
+                             "workers started with --pace send at their assigned rate (0 = ordering only)")
+    parser.add_argument("--coordinator", type=str, default=None,
+                        help="host:port of coordinator.py; run as one shard of a multi-link cluster")
+    parser.add_argument("--shard_id", type=str, default=None,
+                        help="Name of this shard (default: its control port)")
+    parser.add_argument("--advertise_host", type=str, default=None,
+                        help="Address workers should use for this shard (default: the one facing the coordinator)")
+    parser.add_argument("--lease_steps", type=int, default=0,
+                        help="Grant uncontended jobs credit for this many steps at once (0 = ask every step)")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="priority",
+                        help="Order of waiting jobs: highest P, P plus aging, or weighted fair queuing by P")
+    parser.add_argument("--aging_rate", type=float, default=1.0,
+                        help="Priority gained per second of waiting with --policy aging")
+    parser.add_argument("--max_wait", type=float, default=0,
+                        help="Serve any job that has waited this many seconds ahead of the policy's order (0 = off)")
+    parser.add_argument("--results", type=str, default=None,
+                        help="Save per-step records to this .npz file (rewritten every second)")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="Profile from startup and write the report here on SIGUSR1/PROFILE/SIGTERM "
+                             "(default: profiling off until toggled, report in scheduler_profile.txt)")
     args = parser.parse_args()
 
-    sched = Scheduler(args.beta)
-    
-    t_ctrl = threading.Thread(target=sched.start_control_server)
-    t_data = threading.Thread(target=sched.start_data_sink)
-    
-    t_ctrl.start()
-    t_data.start()
-    
-    t_ctrl.join()
-    t_data.join()
+    sock_buf = int(args.sock_buf_mb * 1024 * 1024)
+
+    if args.engine == "asyncio":
+        from async_scheduler import AsyncScheduler as sched_cls
+    else:
+        sched_cls = Scheduler
+
+    sched = sched_cls(args.beta, sock_buf, calib_steps=args.calib_steps, ewma_alpha=args.ewma_alpha,
+                      profile_cache=args.profile_cache, max_concurrent=args.max_concurrent,
+                      inflight_bytes=args.inflight_bytes, chunk_bytes=int(args.chunk_mb * 1024 * 1024),
+                      verify=args.verify, trace=EventTrace() if args.trace else None, lease_steps=args.lease_steps,
+                      link_gbps=args.link_gbps, coordinator=args.coordinator, shard_id=args.shard_id,
+                      advertise_host=args.advertise_host, policy=args.policy, aging_rate=args.aging_rate,
+                      max_wait=args.max_wait, control_port=args.control_port, data_port=args.data_port)
+    if args.trace:
+        sched.trace.start_flusher(args.trace)
+    if args.stats_port:
+        serve_stats(args.stats_port, sched.render_stats)
+    if args.results:
+        sched.results = StepLog(args.results, role="scheduler")
+        sched.results.start_saver(sched.results_meta)
+    # SIGUSR1 or a {"command": "PROFILE"} control message toggles the profiler
+    sched.profiler.install_signal(signal.SIGUSR1)
+    if args.profile:
+        sched.profiler.path = args.profile
+        sched.profiler.start()
+
+    def on_term(signum, frame):
+        # run_experiment.py stops schedulers with SIGTERM; keep the last steps and profile
+        if sched.results:
+            sched.results.save(**sched.results_meta())
+        sched.profiler.stop()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, on_term)
+    sched.run()
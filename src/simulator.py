@@ -0,0 +1,278 @@
+import argparse
+import heapq
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from scheduler import Scheduler
+from policies import POLICIES
+from loadgen import parse_dist
+
+LINK_GBPS = 1.0 # matches the tbf rate deploy_and_run.py puts on the testbed link
+
+class SimJob:
+    """A job replayed in the simulator: one (compute_time, payload_bytes) per step."""
+
+    def __init__(self, job_id, steps):
+        self.job_id = job_id
+        self.steps = steps
+        self.step = 0
+        self.offset = 0 # bytes of the current payload already sent
+        self.grant = 0
+        self.comm = 0.0
+        self.grant_start = 0.0
+        self.jct = None
+
+class SimScheduler(Scheduler):
+    """The real Scheduler, with ALLOW_SEND delivered to the simulator instead of a socket."""
+
+    def __init__(self, sim, beta, **kwargs):
+        self.sim = sim
+        super().__init__(beta, clock=lambda: sim.now, **kwargs)
+
+    def send_to(self, state, msg):
+        # Jobs register with their job_id in place of a socket. Leases (CREDIT,
+        # REVOKE) and rate pacing (RATE) are not modelled, see sweep().
+        if msg["command"] != "ALLOW_SEND":
+            raise ValueError(f"simulator does not model {msg['command']} messages")
+        self.sim.start_transfer(state.sock, msg.get("bytes"))
+
+class Simulation:
+    """Discrete-event simulation of jobs sharing one bottleneck link.
+
+    Compute phases are timed events; the link is modelled as processor
+    sharing, so K admitted senders each get bandwidth / K. Scheduling
+    decisions come from the unmodified Scheduler priority logic.
+    """
+
+    scheduler_class = SimScheduler
+
+    def __init__(self, jobs, beta, link_gbps=LINK_GBPS, **sched_kwargs):
+        self.jobs = {j.job_id: j for j in jobs}
+        self.bandwidth = link_gbps * 1e9 / 8 # bytes/s
+        self.now = 0.0
+        self.events = [] # (time, seq, job_id) compute completions
+        self.seq = 0
+        self.active = {} # {job_id: bytes left in the current grant}
+        self.sched = self.scheduler_class(self, beta, **sched_kwargs)
+
+    def start_transfer(self, job_id, grant):
+        job = self.jobs[job_id]
+        payload = job.steps[job.step][1]
+        job.grant = grant if grant is not None else payload - job.offset
+        job.grant_start = self.now
+        self.active[job_id] = job.grant
+
+    def _compute(self, job):
+        self.seq += 1
+        heapq.heappush(self.events, (self.now + job.steps[job.step][0], self.seq, job.job_id))
+
+    def _advance(self, t):
+        if self.active:
+            sent = (t - self.now) * self.bandwidth / len(self.active)
+            for job_id in self.active:
+                self.active[job_id] -= sent
+        self.now = t
+
+    def _transfer_done(self, job_id):
+        job = self.jobs[job_id]
+        del self.active[job_id]
+        payload = job.steps[job.step][1]
+        job.offset += job.grant
+        job.comm += self.now - job.grant_start
+
+        if job.offset < payload:
+            self.sched.process_message(job_id, {"job_id": job_id, "status": "CHUNK_DONE", "bytes": job.grant})
+            return
+
+        comm_time, job.comm, job.offset = job.comm, 0.0, 0
+        self.sched.process_message(job_id, {"job_id": job_id, "status": "FINISHED", "comm_time": comm_time})
+        job.step += 1
+        if job.step < len(job.steps):
+            self._compute(job)
+        else:
+            job.jct = self.now
+
+    def run(self):
+        for job in self.jobs.values():
+            self._compute(job)
+
+        while self.events or self.active:
+            t_compute = self.events[0][0] if self.events else float("inf")
+            if self.active:
+                # Under processor sharing the smallest remaining grant finishes first
+                left = min(self.active.values())
+                t_link = self.now + max(0.0, left) * len(self.active) / self.bandwidth
+            else:
+                t_link = float("inf")
+
+            if t_link <= t_compute:
+                self._advance(t_link)
+                # Tolerate float drift: whatever is now (near) the minimum is done
+                floor = max(0.0, min(self.active.values())) + 1e-6
+                for job_id in [j for j, rem in self.active.items() if rem <= floor]:
+                    self._transfer_done(job_id)
+            else:
+                self._advance(t_compute)
+                _, _, job_id = heapq.heappop(self.events)
+                self._compute_done(job_id)
+
+        return self.metrics()
+
+    def _compute_done(self, job_id):
+        job = self.jobs[job_id]
+        compute_time, payload = job.steps[job.step]
+        self.sched.process_message(job_id, {"job_id": job_id, "compute_time": compute_time,
+                                            "payload_size": payload, "profile": job_id})
+
+    def metrics(self):
+        ids = list(self.jobs)
+        jct = np.array([self.jobs[j].jct for j in ids])
+        # Time each job would take with the link to itself
+        iso = np.array([sum(c + p / self.bandwidth for c, p in self.jobs[j].steps) for j in ids])
+        total_bytes = sum(p for j in ids for _, p in self.jobs[j].steps)
+        makespan = jct.max()
+        wait_p99 = np.array([self.sched.job_states[j].hist_wait.percentile(99) for j in ids])
+        return {"job_ids": ids, "jct": jct, "iso_time": iso, "wait_p99": wait_p99,
+                "link_util": total_bytes / self.bandwidth / makespan if makespan else 0.0}
+
+def jain_index(x):
+    """Jain's fairness index along the last axis: (sum x)^2 / (n * sum x^2)."""
+    x = np.asarray(x, dtype=float)
+    return x.sum(axis=-1) ** 2 / (x.shape[-1] * (x ** 2).sum(axis=-1))
+
+def testbed_mix(steps=50):
+    """The two jobs deploy_and_run.py runs: A compute-heavy, B communication-heavy."""
+    return [("A", [(0.125, 1 * 1024 * 1024)] * steps),
+            ("B", [(0.005, 50 * 1024 * 1024)] * steps)]
+
+def synthetic_mix(jobs, steps, compute, payload_mb, seed):
+    rng = random.Random(seed)
+    compute_dist, payload_dist = parse_dist(compute), parse_dist(payload_mb)
+    mix = []
+    for i in range(jobs):
+        c, p = max(0.0, compute_dist(rng)), max(1, int(payload_dist(rng) * 1024 * 1024))
+        mix.append((f"sim{i}", [(c, p)] * steps))
+    return mix
+
+def load_trace(path):
+    """Load per-job steps from a JSONL trace.
+
+    Accepts control messages as workers send them ({"job_id", "compute_time",
+    "payload_size"} per step) and worker event traces written with --trace
+    (a "compute" event followed by a "request" event per step).
+    """
+    steps = {}
+    pending_compute = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            job_id = rec.get("job_id")
+            if "compute_time" in rec and "payload_size" in rec:
+                steps.setdefault(job_id, []).append((rec["compute_time"], rec["payload_size"]))
+            elif rec.get("event") == "compute":
+                pending_compute[job_id] = pending_compute.get(job_id, 0.0) + rec["value"]
+            elif rec.get("event") == "request":
+                c = pending_compute.pop(job_id, 0.0)
+                steps.setdefault(job_id, []).append((c, int(rec["value"])))
+    return list(steps.items())
+
+def simulate(link_gbps, sched_kwargs, mix, beta):
+    # One (mix, beta) run; module-level so worker processes can pickle it
+    return Simulation([SimJob(j, s) for j, s in mix], beta, link_gbps, **sched_kwargs).run()
+
+def sweep(mixes, betas, link_gbps=LINK_GBPS, parallel=1, **sched_kwargs):
+    """Simulate every (mix, beta) pair.
+
+    Returns arrays shaped (len(mixes), len(betas)) for link utilization,
+    Jain's index over normalized throughput, mean and max JCT, and the worst
+    job's p99 wait for ALLOW. Jobs only follow per-step ALLOW_SEND, so the
+    scheduler's lease_steps is rejected; link_gbps here is the simulated link,
+    so the scheduler's rate pacing stays off.
+
+    Every pair is its own event loop (decisions, and so events, differ per
+    beta); `parallel` > 1 spreads them over that many processes.
+    """
+    if sched_kwargs.get("lease_steps"):
+        raise ValueError("the simulator does not model leases (lease_steps)")
+    run = partial(simulate, link_gbps, sched_kwargs)
+    mix_of, beta_of = zip(*[(mix, beta) for mix in mixes for beta in betas])
+    if parallel > 1:
+        with ProcessPoolExecutor(max_workers=parallel) as pool:
+            runs = list(pool.map(run, mix_of, beta_of, chunksize=max(1, len(beta_of) // (4 * parallel))))
+    else:
+        runs = list(map(run, mix_of, beta_of))
+
+    shape = (len(mixes), len(betas))
+    util, jain, mean_jct, max_jct, wait_p99 = (np.zeros(shape) for _ in range(5))
+    for m, mix in enumerate(mixes):
+        jct = np.zeros((len(betas), len(mix)))
+        iso = None
+        for b in range(len(betas)):
+            r = runs[m * len(betas) + b]
+            jct[b], iso = r["jct"], r["iso_time"]
+            util[m, b] = r["link_util"]
+            wait_p99[m, b] = r["wait_p99"].max()
+        # Per-job normalized throughput (1 / slowdown), computed for all betas at once
+        jain[m] = jain_index(iso / jct)
+        mean_jct[m] = jct.mean(axis=1)
+        max_jct[m] = jct.max(axis=1)
+    return {"beta": np.asarray(betas), "link_util": util, "jain": jain, "mean_jct": mean_jct, "max_jct": max_jct,
+            "wait_p99": wait_p99}
+
+def parse_betas(spec):
+    """"0.5" -> [0.5]; "0:1:101" -> 101 values from 0 to 1; "0,0.5,1" -> list."""
+    if ":" in spec:
+        lo, hi, n = spec.split(":")
+        return np.linspace(float(lo), float(hi), int(n))
+    return np.array([float(v) for v in spec.split(",")])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline discrete-event simulator for scheduling policies")
+    parser.add_argument("--betas", type=str, default="0:1:11",
+                        help="Beta values: LO:HI:N, a comma-separated list, or one value")
+    parser.add_argument("--trace", type=str, default=None, help="Replay job steps from a JSONL trace")
+    parser.add_argument("--jobs", type=int, default=0,
+                        help="Synthetic job count (default: the two-job testbed mix)")
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--compute", type=str, default="exp:0.05")
+    parser.add_argument("--payload_mb", type=str, default="choice:1,10,50")
+    parser.add_argument("--mixes", type=int, default=1, help="Number of random job mixes (seeds)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--link_gbps", type=float, default=LINK_GBPS)
+    parser.add_argument("--calib_steps", type=int, default=3)
+    parser.add_argument("--max-concurrent", dest="max_concurrent", type=int, default=1)
+    parser.add_argument("--chunk_mb", type=float, default=0)
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="priority")
+    parser.add_argument("--aging_rate", type=float, default=1.0)
+    parser.add_argument("--max_wait", type=float, default=0)
+    parser.add_argument("--parallel", type=int, default=os.cpu_count() or 1,
+                        help="Simulations to run at once, one process each")
+    parser.add_argument("--out", type=str, default=None, help="Save the result arrays to this .npz file")
+    args = parser.parse_args()
+
+    if args.trace:
+        mixes = [load_trace(args.trace)]
+    elif args.jobs:
+        mixes = [synthetic_mix(args.jobs, args.steps, args.compute, args.payload_mb, args.seed + m)
+                 for m in range(args.mixes)]
+    else:
+        mixes = [testbed_mix(args.steps)]
+
+    res = sweep(mixes, parse_betas(args.betas), args.link_gbps, args.parallel, calib_steps=args.calib_steps,
+                max_concurrent=args.max_concurrent, chunk_bytes=int(args.chunk_mb * 1024 * 1024),
+                policy=args.policy, aging_rate=args.aging_rate, max_wait=args.max_wait)
+
+    print(f"{'beta':>6} {'util':>7} {'jain':>7} {'mean_jct':>10} {'max_jct':>10} {'wait_p99':>10}"
+          f"   (averaged over {len(mixes)} mix(es))")
+    for b, beta in enumerate(res["beta"]):
+        print(f"{beta:6.3f} {res['link_util'][:, b].mean():7.4f} {res['jain'][:, b].mean():7.4f} "
+              f"{res['mean_jct'][:, b].mean():10.3f} {res['max_jct'][:, b].mean():10.3f} "
+              f"{res['wait_p99'][:, b].mean():10.3f}")
+    if args.out:
+        np.savez(args.out, **res)
@@ -0,0 +1,286 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class EventTrace:
+    """Fixed-size in-memory ring of timestamped events.
+
+    record() only stores into preallocated slots, with no lock and no I/O,
+    so it is cheap enough for the per-message path. A background thread
+    appends new events to a JSONL file; if the ring laps the flusher, the
+    oldest events are dropped and counted.
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.ts = [0.0] * capacity
+        self.kind = [None] * capacity
+        self.job = [None] * capacity
+        self.value = [0.0] * capacity
+        self.count = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.flush_lock = threading.Lock() # writers never take it
+
+    def record(self, kind, job_id, value=0.0):
+        i = self.count % self.capacity
+        self.ts[i] = time.time()
+        self.kind[i] = kind
+        self.job[i] = job_id
+        self.value[i] = value
+        self.count += 1
+
+    def flush(self, f):
+        with self.flush_lock:
+            self._flush(f)
+
+    def _flush(self, f):
+        end = self.count
+        start = max(self.flushed, end - self.capacity)
+        self.dropped += start - self.flushed
+        for n in range(start, end):
+            i = n % self.capacity
+            f.write(json.dumps({"ts": self.ts[i], "event": self.kind[i], "job_id": self.job[i],
+                                "value": self.value[i]}) + "\n")
+        f.flush()
+        self.flushed = end
+
+    def start_flusher(self, path, interval=1.0):
+        def loop():
+            with open(path, "a") as f:
+                while True:
+                    time.sleep(interval)
+                    self.flush(f)
+
+        t = threading.Thread(target=loop)
+        t.daemon = True
+        t.start()
+
+# One row per completed step; job is an index into the file's "jobs" array
+STEP_DTYPE = np.dtype([("job", "i4"), ("end", "f8"), ("compute", "f4"), ("wait", "f4"), ("comm", "f4"),
+                       ("step_time", "f4"), ("bytes", "i8"), ("goodput", "f4")])
+
+class StepLog:
+    """Per-step results as a NumPy structured array, saved to an .npz file.
+
+    Rows are fixed-width (job ids are interned into a small table) and the
+    array doubles when full, so record() is a single row store. save()
+    writes the rows, the job table and run metadata atomically, so a reader
+    never sees a half-written file, even while the scheduler keeps saving.
+    """
+
+    def __init__(self, path, capacity=4096, **meta):
+        self.path = path
+        self.meta = meta
+        self.rows = np.zeros(capacity, STEP_DTYPE)
+        self.count = 0
+        self.jobs = {} # job_id -> index
+        self.lock = threading.Lock() # between writers; save() reads without it
+
+    def record(self, job_id, end, compute, wait, comm, step_time, nbytes, goodput=0.0):
+        with self.lock:
+            job = self.jobs.setdefault(job_id, len(self.jobs))
+            if self.count == len(self.rows):
+                rows = np.zeros(2 * len(self.rows), STEP_DTYPE)
+                rows[:self.count] = self.rows
+                self.rows = rows
+            self.rows[self.count] = (job, end, compute, wait, comm, step_time, nbytes, goodput)
+            self.count += 1
+
+    def save(self, **meta):
+        rows = self.rows
+        steps = rows[:min(self.count, len(rows))].copy()
+        jobs = np.array([str(j) for j in list(self.jobs)])
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, steps=steps, jobs=jobs, **self.meta, **meta)
+        os.replace(tmp, self.path)
+
+    def start_saver(self, meta=dict, interval=1.0):
+        """Re-save every interval seconds, with save(**meta()), for processes that are killed rather than stopped."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.save(**meta())
+
+        t = threading.Thread(target=loop)
+        t.daemon = True
+        t.start()
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram of latencies, recorded in microseconds.
+
+    Values are bucketed by power of two with 2**SUB_BITS linear sub-buckets
+    each, giving ~3% relative precision over the full range. Buckets are
+    kept sparsely, so an idle histogram costs almost nothing per job.
+    """
+
+    SUB_BITS = 5
+    __slots__ = ("counts", "total", "sum", "max")
+
+    def __init__(self):
+        self.counts = {} # bucket index -> count
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _index(self, us):
+        bits = us.bit_length()
+        if bits <= self.SUB_BITS:
+            return us
+        shift = bits - self.SUB_BITS
+        return (shift << self.SUB_BITS) + (us >> shift)
+
+    def _value(self, idx):
+        shift = idx >> self.SUB_BITS
+        if not shift:
+            return idx
+        return (idx & ((1 << self.SUB_BITS) - 1)) << shift
+
+    def record(self, seconds):
+        idx = self._index(max(0, int(seconds * 1e6)))
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.total += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Return the p-th percentile (0-100) in seconds, 0.0 if empty."""
+        if not self.total:
+            return 0.0
+        target = max(1, int(round(self.total * p / 100.0)))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= target:
+                return self._value(idx) / 1e6
+        return self.max
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+    def summary(self):
+        return {"count": self.total, "mean": self.mean(), "p50": self.percentile(50),
+                "p99": self.percentile(99), "max": self.max}
+
+# Up to 3.11 cProfile hooks the calling thread only; from 3.12 it is process-wide
+# and only one profile can be active at a time
+PER_THREAD_PROFILE = sys.version_info < (3, 12)
+
+class Profiler:
+    """cProfile switched on and off at runtime, measuring marked sections only.
+
+    Long-lived loops mark each unit of work (a batch of control messages, a
+    transfer, a training step) with begin()/end() or call(). While enabled,
+    every thread gets its own cProfile.Profile timed by its own CPU clock,
+    so time blocked in socket calls costs nothing and threads never share a
+    profile. stop() merges them and appends a per-function report to
+    `path`. While disabled, a section costs one attribute check.
+
+    On Python 3.12+ a single wall-clock profile covers the whole process
+    between start() and stop() instead, and sections are not used.
+    """
+
+    def __init__(self, path, top=40):
+        self.path = path
+        self.top = top
+        self.enabled = False
+        self.local = threading.local()
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.started = 0.0
+
+    def start(self):
+        if self.enabled:
+            return
+        self.local = threading.local()
+        self.profiles = []
+        self.started = time.time()
+        if not PER_THREAD_PROFILE:
+            self.profiles.append(cProfile.Profile())
+            self.profiles[0].enable()
+        self.enabled = True
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        with self.lock:
+            profiles = list(self.profiles)
+        if not PER_THREAD_PROFILE:
+            profiles[0].disable()
+        if not profiles:
+            return
+        # Sections still running finish into a profile that is already reported
+        stats = pstats.Stats(*profiles, stream=io.StringIO())
+        with open(self.path, "a") as f:
+            clock = "thread CPU time" if PER_THREAD_PROFILE else "wall time, all threads"
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')}: {len(profiles)} profile(s) over "
+                    f"{time.time() - self.started:.1f}s, {clock}\n")
+            stats.stream = f
+            stats.sort_stats("tottime").print_stats(self.top)
+        print(f"Profile written to {self.path}")
+
+    def toggle(self):
+        if self.enabled:
+            self.stop()
+        else:
+            self.start()
+        return self.enabled
+
+    def begin(self):
+        """Start a section on this thread; hand the result to end()."""
+        if not self.enabled or not PER_THREAD_PROFILE:
+            return None
+        prof = getattr(self.local, "prof", None)
+        if prof is None:
+            prof = self.local.prof = cProfile.Profile(time.thread_time)
+            with self.lock:
+                self.profiles.append(prof)
+        prof.enable()
+        return prof
+
+    def end(self, prof):
+        if prof is not None:
+            prof.disable()
+
+    def call(self, func, *args):
+        prof = self.begin()
+        try:
+            return func(*args)
+        finally:
+            self.end(prof)
+
+    def install_signal(self, signum):
+        """Toggle on `signum` (e.g. SIGUSR1) from the main thread."""
+        signal.signal(signum, lambda *_: self.toggle())
+
+def serve_stats(port, render):
+    """Serve render()'s text on http://0.0.0.0:port/ from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
@@ -1,53 +1,392 @@
 import socket
 import struct
 import json
+import time
+import ipaddress
+from collections import deque
+from multiprocessing import shared_memory, resource_tracker
 
 # Constants
 SCHEDULER_HOST = '0.0.0.0'
 SCHEDULER_CONTROL_PORT = 5000
 WORKER_DATA_PORT = 6000
+COORDINATOR_PORT = 7000
+LISTEN_BACKLOG = 128
 
-# Message Types
-MSG_ALLOW = b"ALLOW_SEND\n"
-MSG_WAIT = b"WAIT\n"
+# Bulk transfer tuning
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+SINK_CHUNK_SIZE = 1024 * 1024
+PACE_BURST = 256 * 1024 # token-bucket depth and paced send slice
+PACE_MAX_SLEEP = 0.05 # longest pacer sleep before re-reading the rate
+
+# Data sink ack after each bulk transfer: (payload bytes, seconds from first to last byte)
+ACK = struct.Struct('!Qd')
+
+# Shared-memory transport for co-located workers and sink
+SHM_HELLO = 1 << 63 # bulk header value that opens the handshake instead of a payload
+SHM_HELLO_BODY = struct.Struct('!QH') # ring size, name length; the name follows
+SHM_RING_SIZE = 16 * 1024 * 1024 # worker -> sink ring
+SHM_BACK_SIZE = 64 * 1024 # sink -> worker ring, carries only acks
+
+def ewma(prev, sample, alpha):
+    """Helper for an exponentially weighted moving average update."""
+    return alpha * sample + (1 - alpha) * prev
 
 def send_json(sock, data):
     """Helper to send JSON data over a socket."""
     msg = json.dumps(data) + "\n"
     sock.sendall(msg.encode('utf-8'))
 
-def recv_json(sock):
-    """Helper to receive a JSON line from a socket."""
+def split_messages(buf):
+    """Helper to pop every complete JSON line off the front of a bytearray.
+
+    Returns the decoded messages, or None if no complete line is buffered.
+    """
+    end = buf.rfind(b"\n")
+    if end < 0:
+        return None
+    lines = bytes(buf[:end]).split(b"\n")
+    del buf[:end + 1]
+    return [json.loads(line) for line in lines if line]
+
+class MessageReader:
+    """Buffered reader for newline-framed JSON messages on one socket.
+
+    Reads the socket in large chunks into an internal buffer instead of one
+    byte per recv() call, so several messages can arrive in one syscall.
+    """
+
+    def __init__(self, sock, bufsize=65536):
+        self.sock = sock
+        self.bufsize = bufsize
+        self.buf = bytearray()
+        self.pending = deque()
+
+    def _fill(self):
+        try:
+            chunk = self.sock.recv(self.bufsize)
+        except OSError:
+            return False
+        if not chunk:
+            return False
+        self.buf += chunk
+        return True
+
+    def _decode_buffered(self):
+        msgs = split_messages(self.buf)
+        if msgs is None:
+            return False
+        self.pending.extend(msgs)
+        return True
+
+    def recv_many(self):
+        """Return every complete message available, blocking for at least one.
+
+        Returns an empty list when the peer closed the connection.
+        """
+        try:
+            while not self.pending:
+                if not self._decode_buffered() and not self._fill():
+                    return []
+        except ValueError:
+            return []
+        msgs = list(self.pending)
+        self.pending.clear()
+        return msgs
+
+    def recv(self):
+        """Return the next message, or None when the connection is closed."""
+        if not self.pending:
+            self.pending.extend(self.recv_many())
+            if not self.pending:
+                return None
+        return self.pending.popleft()
+
+def tune_socket(sock, bufsize=SOCKET_BUFFER_SIZE):
+    """Helper to enlarge kernel send/receive buffers for bulk transfers.
+
+    Call before connect()/listen() so the TCP window scale is negotiated
+    with the larger buffers.
+    """
+    if bufsize:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, bufsize)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, bufsize)
+
+def make_listener(port, sock_buf=0):
+    """Helper to bind a listening TCP socket. Port 0 picks a free port."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    tune_socket(s, sock_buf)
+    s.bind((SCHEDULER_HOST, port))
+    s.listen(LISTEN_BACKLOG)
+    return s
+
+class TokenBucket:
+    """Token-bucket pacer: consume(n) sleeps until n more bytes fit under `rate` bytes/s."""
+
+    def __init__(self, rate=0.0, burst=PACE_BURST):
+        self.rate = rate # 0 = unpaced
+        self.burst = burst
+        self.tokens = burst
+        self.ts = time.time()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+        self.tokens -= n
+        while self.tokens < 0 and self.rate:
+            # Sleep off the debt in short slices, so a RATE update applies mid-debt
+            time.sleep(min(-self.tokens / self.rate, PACE_MAX_SLEEP))
+            now = time.time()
+            self.tokens += (now - self.ts) * self.rate
+            self.ts = now
+
+def is_loopback(host):
     try:
-        data = b""
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+class ShmStream:
+    """Socket-like byte stream over shared memory, for a worker and sink on one host.
+
+    Each direction is a single-producer ring with monotonic write/read
+    counters in the segment header. The TCP data connection stays open as
+    the doorbell: after moving bytes a side sends one byte, and a side that
+    has to wait blocks in recv() on the socket. send_bulk(), the sink's
+    recv_bulk_header()/discard_exact() and acks work on it unchanged.
+    """
+
+    HEADER = 64 # four uint64 counters: fwd write/read, back write/read
+
+    def __init__(self, sock, shm, ring_size, creator):
+        self.sock = sock
+        self.shm = shm
+        self.ctr = shm.buf[:self.HEADER].cast('Q')
+        fwd = shm.buf[self.HEADER:self.HEADER + ring_size]
+        back = shm.buf[self.HEADER + ring_size:self.HEADER + ring_size + SHM_BACK_SIZE]
+        # The creator (worker) writes the forward ring, the sink the back ring
+        if creator:
+            self.tx, self.rx, self.tx_idx, self.rx_idx = fwd, back, 0, 2
+        else:
+            self.tx, self.rx, self.tx_idx, self.rx_idx = back, fwd, 2, 0
+
+    @classmethod
+    def connect(cls, sock, ring_size=SHM_RING_SIZE):
+        """Offer shared memory on a connected data socket. Returns None if the sink declines."""
+        shm = shared_memory.SharedMemory(create=True, size=cls.HEADER + ring_size + SHM_BACK_SIZE)
+        name = shm.name.encode('utf-8')
+        sock.sendall(struct.pack('!Q', SHM_HELLO) + SHM_HELLO_BODY.pack(ring_size, len(name)) + name)
+        reply = sock.recv(1)
+        # Both sides have it mapped (or never will), so the name can go
+        shm.unlink()
+        if reply != b"\x01":
+            shm.close()
+            return None
+        return cls(sock, shm, ring_size, creator=True)
+
+    @classmethod
+    def accept(cls, sock):
+        """Sink side of the handshake, after reading a SHM_HELLO header."""
+        body = bytearray(SHM_HELLO_BODY.size)
+        if not recv_exact_into(sock, memoryview(body)):
+            return None
+        ring_size, n = SHM_HELLO_BODY.unpack(body)
+        name = bytearray(n)
+        if not recv_exact_into(sock, memoryview(name)):
+            return None
+        shm = attach_shm(name.decode('utf-8'))
+        if shm is None:
+            # Not on the same host: carry on over TCP
+            sock.sendall(b"\x00")
+            return None
+        sock.sendall(b"\x01")
+        return cls(sock, shm, ring_size, creator=False)
+
+    def _wait(self):
+        if not self.sock.recv(4096):
+            raise ConnectionError("shared-memory peer closed the connection")
+
+    def _ring(self):
+        self.sock.sendall(b"\x01")
+
+    def sendall(self, data):
+        view = memoryview(data).cast('B')
+        size = len(self.tx)
+        while view.nbytes:
+            w = self.ctr[self.tx_idx]
+            free = size - (w - self.ctr[self.tx_idx + 1])
+            if not free:
+                self._wait()
+                continue
+            pos = w % size
+            n = min(free, view.nbytes, size - pos)
+            self.tx[pos:pos + n] = view[:n]
+            self.ctr[self.tx_idx] = w + n
+            view = view[n:]
+            self._ring()
+
+    def _available(self):
+        """View of the contiguous readable bytes, or None if the ring is empty."""
+        r = self.ctr[self.rx_idx + 1]
+        avail = self.ctr[self.rx_idx] - r
+        if not avail:
+            return None
+        size = len(self.rx)
+        pos = r % size
+        return self.rx[pos:pos + min(avail, size - pos)]
+
+    def _readable(self):
+        # Block until data is available
         while True:
-            chunk = sock.recv(1)
-            if not chunk:
-                return None
-            data += chunk
-            if chunk == b"\n":
-                break
-        return json.loads(data.decode('utf-8'))
-    except Exception:
+            view = self._available()
+            if view is not None:
+                return view
+            self._wait()
+
+    def _consume(self, n):
+        self.ctr[self.rx_idx + 1] += n
+        self._ring()
+
+    def recv_into(self, buf, nbytes=0):
+        try:
+            view = self._readable()
+        except ConnectionError:
+            return 0
+        out = memoryview(buf).cast('B')
+        n = min(view.nbytes, nbytes or out.nbytes, out.nbytes)
+        out[:n] = view[:n]
+        view.release()
+        self._consume(n)
+        return n
+
+    def discard(self, length, on_data=None):
+        """Consume `length` bytes in place, without copying them out."""
+        while length:
+            try:
+                view = self._readable()
+            except ConnectionError:
+                return False
+            n = min(view.nbytes, length)
+            if on_data:
+                on_data(view[:n])
+            view.release()
+            self._consume(n)
+            length -= n
+        return True
+
+    def close(self):
+        for view in (self.ctr, self.tx, self.rx):
+            view.release()
+        self.shm.close()
+        self.sock.close()
+
+def attach_shm(name):
+    """Map another process's segment, or None if it does not exist here."""
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except (FileNotFoundError, ValueError):
         return None
+    # The creator owns (and already unlinked) it; don't let our tracker unlink it again
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+def send_bulk(sock, data, pacer=None):
+    """Helper to send bulk bytes prefixed with length.
 
-def send_bulk(sock, data):
-    """Helper to send bulk bytes prefixed with length."""
-    length = len(data)
-    sock.sendall(struct.pack('!Q', length))
-    sock.sendall(data)
+    The header and payload go out in one sendmsg() call (scatter-gather),
+    and the payload is never copied in user space. With a TokenBucket
+    pacer, the payload is sent in PACE_BURST slices at the pacer's rate.
+    """
+    view = memoryview(data).cast('B')
+    header = struct.pack('!Q', view.nbytes)
+    if pacer and pacer.rate:
+        sock.sendall(header)
+        for off in range(0, view.nbytes, PACE_BURST):
+            piece = view[off:off + PACE_BURST]
+            pacer.consume(piece.nbytes)
+            sock.sendall(piece)
+        return
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(header)
+        sock.sendall(view)
+        return
+    sent = sock.sendmsg([header, view])
+    if sent < len(header):
+        sock.sendall(header[sent:])
+        sent = len(header)
+    if sent - len(header) < view.nbytes:
+        sock.sendall(view[sent - len(header):])
 
-def recv_bulk(sock):
-    """Helper to receive bulk bytes prefixed with length."""
-    len_data = sock.recv(8)
-    if not len_data:
+def recv_exact_into(sock, view):
+    """Helper to fill a memoryview completely. Returns False on early EOF."""
+    while view.nbytes:
+        n = sock.recv_into(view)
+        if n == 0:
+            return False
+        view = view[n:]
+    return True
+
+def recv_bulk_header(sock):
+    """Helper to receive the 8-byte length prefix of a bulk transfer."""
+    header = bytearray(8)
+    if not recv_exact_into(sock, memoryview(header)):
         return None
-    length = struct.unpack('!Q', len_data)[0]
-    
-    data = b""
-    while len(data) < length:
-        chunk = sock.recv(min(4096, length - len(data)))
-        if not chunk:
-            break
-        data += chunk
-    return data
+    return struct.unpack('!Q', header)[0]
+
+def recv_bulk(sock, buf=None):
+    """Helper to receive bulk bytes prefixed with length.
+
+    Data is read straight into `buf` when it is large enough (so callers can
+    reuse one preallocated bytearray), otherwise into a new bytearray.
+    Returns a memoryview of the payload, or None if the connection closed.
+    """
+    length = recv_bulk_header(sock)
+    if length is None:
+        return None
+    if buf is None or len(buf) < length:
+        buf = bytearray(length)
+    view = memoryview(buf)[:length]
+    if not recv_exact_into(sock, view):
+        return None
+    return view
+
+def discard_bulk(sock, scratch, on_data=None):
+    """Helper to receive and drop one bulk transfer using a scratch buffer.
+
+    If given, on_data is called with a memoryview of each piece read, e.g. to
+    checksum the payload without keeping it. Returns the payload length, or
+    None if the connection closed.
+    """
+    length = recv_bulk_header(sock)
+    if length is None or not discard_exact(sock, scratch, length, on_data):
+        return None
+    return length
+
+def discard_exact(sock, scratch, length, on_data=None):
+    """Helper to receive and drop `length` bytes. Returns False on early EOF."""
+    if isinstance(sock, ShmStream):
+        return sock.discard(length, on_data)
+    view = memoryview(scratch)
+    remaining = length
+    while remaining:
+        n = sock.recv_into(view, min(remaining, len(view)))
+        if n == 0:
+            return False
+        if on_data:
+            on_data(view[:n])
+        remaining -= n
+    return True
+
+def send_ack(sock, nbytes, seconds):
+    sock.sendall(ACK.pack(nbytes, seconds))
+
+def recv_ack(sock):
+    """Helper to receive one data sink ack. Returns (bytes, seconds) or None."""
+    buf = bytearray(ACK.size)
+    if not recv_exact_into(sock, memoryview(buf)):
+        return None
+    return ACK.unpack(buf)
@@ -1,10 +1,17 @@
 import time
 import socket
+import signal
 import argparse
+import threading
+import queue
 import torch
 import torch.nn as nn
 import numpy as np
 from utils import *
+from grad_codec import GradientPacker, CODECS
+from control_codec import *
+from telemetry import EventTrace, LatencyHistogram, StepLog, Profiler
+from coordinator import place_job
 
 class SimpleModel(nn.Module):
     def __init__(self, size):
@@ -14,95 +21,604 @@ class SimpleModel(nn.Module):
     def forward(self, x):
         return self.fc(x)
 
-def run_worker(job_id, scheduler_host, receiver_host, model_size, grad_mb, steps):
-    print(f"Worker {job_id} starting...")
-    
-    # Connect to Scheduler (Control)
-    ctrl_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+class ControlConnection:
+    """A control connection shared by the jobs of one worker process.
+
+    A reader thread owns the socket and hands each scheduler message to the
+    channel named by its job_id; sends from any job are serialized. With
+    `binary`, messages travel as control_codec frames; jobs still see dicts.
+    """
+
+    def __init__(self, sock, binary=False):
+        self.sock = sock
+        self.binary = binary
+        self.reader = MessageReader(sock)
+        self.send_lock = threading.Lock()
+        self.channels = {} # job_id -> JobChannel
+        self.nums = {} # job_id -> job number announced on this connection, binary only
+        self.names = {} # job number -> job_id
+
+    def add(self, chan):
+        self.channels[chan.job_id] = chan
+
+    def start(self):
+        t = threading.Thread(target=self.read_loop)
+        t.daemon = True
+        t.start()
+
+    def send(self, msg):
+        with self.send_lock:
+            if not self.binary:
+                send_json(self.sock, msg)
+                return
+            job_id = msg["job_id"]
+            num = self.nums.get(job_id)
+            if num is None:
+                # First message of the job: announce it, with its profile, under a number
+                num = self.nums[job_id] = len(self.nums)
+                self.names[num] = job_id
+                self.sock.sendall(encode_job(num, job_id, msg.get("profile")) + encode_message(num, msg))
+            else:
+                self.sock.sendall(encode_message(num, msg))
+
+    def recv_many(self):
+        """Every message available, blocking for at least one; [] once the connection is gone."""
+        if not self.binary:
+            return self.reader.recv_many()
+        buf = self.reader.buf
+        try:
+            frames = split_frames(buf)
+            while not frames:
+                chunk = self.sock.recv(65536)
+                if not chunk:
+                    return []
+                buf += chunk
+                frames = split_frames(buf)
+        except (OSError, ValueError):
+            return []
+        return [decode_message(frame, self.names.get(frame[1])) for frame in frames]
+
+    def read_loop(self):
+        while True:
+            msgs = self.recv_many()
+            if not msgs:
+                for chan in self.channels.values():
+                    chan.grants.put(None)
+                return
+            for msg in msgs:
+                chan = self.channels.get(msg.get("job_id"))
+                if chan:
+                    chan.dispatch(msg)
+
+    def close(self):
+        self.sock.close()
+
+class DataPool:
+    """Data connections shared by the jobs of one worker process.
+
+    Acks come back on the connection a transfer was sent on, and the sink
+    checks a payload per connection (--verify), so a payload holds its
+    connection from the first chunk to the last. Between chunks it is
+    parked; when every connection is parked, waiting on one could never end,
+    so another is opened instead.
+    """
+
+    def __init__(self, conns, connect):
+        self.conns = conns
+        self.connect = connect # opens one more data connection
+        self.free = list(conns)
+        self.parked = 0 # connections held by a payload waiting for its next chunk
+        self.cond = threading.Condition()
+
+    def get(self):
+        with self.cond:
+            while not self.free:
+                if self.parked == len(self.conns):
+                    conn = self.connect()
+                    self.conns.append(conn)
+                    return conn
+                self.cond.wait()
+            return self.free.pop()
+
+    def put(self, conn):
+        with self.cond:
+            self.free.append(conn)
+            self.cond.notify()
+
+    def park(self, parked):
+        with self.cond:
+            self.parked += 1 if parked else -1
+            self.cond.notify_all()
+
+    def close(self):
+        for conn in self.conns:
+            conn.close()
+
+class JobChannel:
+    """One job's view of the control and data connections and the per-step send protocol.
+
+    The connection's reader thread dispatches to the channel: ALLOW_SEND
+    grants are queued for transfer(), while lease updates (CREDIT/REVOKE)
+    are applied as soon as they arrive, even while the job is computing.
+    Slotted, since a multi-job worker keeps one per job.
+    """
+
+    __slots__ = ("job_id", "ctrl", "data", "trace", "results", "hist_allow", "hist_comm", "request_ts", "allow_latency",
+                 "payload_size", "step_info", "goodput", "pacer", "lease_lock", "leased", "credit", "sending",
+                 "release_after", "on_credit", "grants")
+
+    def __init__(self, job_id, ctrl, data, trace=None, pace=False, results=None):
+        self.job_id = job_id
+        self.ctrl = ctrl
+        self.data = data
+        self.trace = trace
+        self.results = results # StepLog shared by the process's jobs, or None
+        self.hist_allow = LatencyHistogram() # request -> first ALLOW_SEND
+        self.hist_comm = LatencyHistogram()
+        self.request_ts = 0.0
+        self.allow_latency = 0.0
+        self.payload_size = 0
+        self.step_info = None
+        self.goodput = 0.0 # sink-measured bytes/s of the last transfer
+        # Send at the scheduler-assigned rate ("rate" in ALLOW_SEND / RATE)
+        self.pacer = TokenBucket() if pace else None
+        # Credit lease: while leased, steps are sent without asking and
+        # reported afterwards in a single SPENT message
+        self.lease_lock = threading.Lock()
+        self.leased = False
+        self.credit = 0
+        self.sending = False # a leased transfer is under way; RELEASE must wait for it
+        self.release_after = False
+        self.on_credit = False # current step is paid from the lease
+        self.grants = queue.Queue()
+        ctrl.add(self)
+
+    def send(self, msg):
+        self.ctrl.send(msg)
+
+    def dispatch(self, msg):
+        cmd = msg.get("command")
+        if "rate" in msg and self.pacer:
+            self.pacer.rate = msg["rate"]
+        if cmd == "RATE":
+            return
+        with self.lease_lock:
+            if cmd == "ALLOW_SEND" and "credit" in msg:
+                # This grant opens a lease covering the next few steps too
+                self.leased = True
+                self.credit = msg["credit"]
+                self.sending = True
+            elif cmd == "CREDIT":
+                # Stale refills (lease already gone) are ignored
+                if self.leased:
+                    self.credit += msg["bytes"]
+                return
+            elif cmd == "REVOKE":
+                if self.leased:
+                    self.leased = False
+                    self.credit = 0
+                    if self.sending:
+                        self.release_after = True
+                    else:
+                        self.send({"job_id": self.job_id, "status": "RELEASE"})
+                return
+        self.grants.put(msg)
+
+    def request(self, compute_time, payload_size, profile, overlap=False):
+        # Protocol: Send metrics -> Wait for ALLOW -> Send Data -> Measure Comm Time
+        self.payload_size = payload_size
+        if self.trace:
+            self.trace.record("request", self.job_id, payload_size)
+        with self.lease_lock:
+            self.on_credit = self.leased and self.credit >= payload_size
+            if self.on_credit:
+                self.sending = True
+            else:
+                # Out of credit: the request itself tells the scheduler the lease is over
+                self.leased = False
+                self.credit = 0
+        self.step_info = (compute_time, payload_size, overlap)
+        if self.on_credit:
+            self.request_ts = time.time()
+            return
+
+        req = {
+            "job_id": self.job_id,
+            "compute_time": compute_time,
+            "payload_size": payload_size,
+            # Jobs with the same shape share a cached isolated-throughput profile
+            "profile": profile
+        }
+        if overlap:
+            req["overlap"] = True
+        self.request_ts = time.time()
+        self.send(req)
+
+    def transfer(self, payload_view):
+        """Wait for ALLOW_SEND grants and push the payload. Returns comm time."""
+        # The scheduler may grant the payload in chunks ("bytes" in ALLOW_SEND)
+        # and hand the link to another job between chunks.
+        payload_size = payload_view.nbytes
+        offset = 0
+        comm_time = 0.0
+        sink_time = 0.0
+        conn = None # every chunk of the payload goes on the same data connection
+        parked = False
+        try:
+            while True:
+                if self.on_credit:
+                    resp = {"command": "ALLOW_SEND"}
+                else:
+                    resp = self.grants.get()
+                if resp is None:
+                    raise ConnectionError("scheduler closed the control connection")
+                if resp.get("command") != "ALLOW_SEND":
+                    continue
+                if offset == 0:
+                    self.allow_latency = time.time() - self.request_ts
+                    self.hist_allow.record(self.allow_latency)
+
+                grant = resp.get("bytes", payload_size - offset)
+                if self.trace:
+                    self.trace.record("send_start", self.job_id, grant)
+                start_comm = time.time()
+                if conn is None:
+                    conn = self.data.get()
+                elif parked:
+                    parked = False
+                    self.data.park(False)
+                send_bulk(conn, payload_view[offset:offset + grant], self.pacer)
+                # sendall() returns once the kernel has the data; the sink's ack
+                # marks when it actually arrived
+                ack = recv_ack(conn)
+                if ack is None:
+                    raise ConnectionError("data sink closed the connection")
+                comm_time += time.time() - start_comm
+                sink_time += ack[1]
+                if self.trace:
+                    self.trace.record("send_end", self.job_id, grant)
+                offset += grant
+                if offset >= payload_size:
+                    self.goodput = payload_size / sink_time if sink_time else 0.0
+                    return comm_time
+                parked = True
+                self.data.park(True)
+                self.send({"job_id": self.job_id, "status": "CHUNK_DONE", "bytes": grant})
+        finally:
+            if parked:
+                self.data.park(False)
+            if conn is not None:
+                self.data.put(conn)
+
+    def finish(self, comm_time, step_time=None):
+        # Report completion to scheduler? 
+        # The scheduler needs to know we finished to schedule others.
+        # We can send a "FINISHED" message on control socket.
+        if self.on_credit:
+            compute_time, payload_size, overlap = self.step_info
+            msg = {"job_id": self.job_id, "status": "SPENT", "comm_time": comm_time,
+                   "compute_time": compute_time, "payload_size": payload_size}
+            if overlap:
+                msg["overlap"] = True
+        else:
+            msg = {"job_id": self.job_id, "status": "FINISHED", "comm_time": comm_time,
+                   "allow_latency": self.allow_latency}
+        if step_time is not None:
+            msg["step_time"] = step_time
+        if self.goodput:
+            msg["goodput"] = self.goodput
+        self.hist_comm.record(comm_time)
+        if self.results:
+            compute_time, payload_size, _ = self.step_info
+            wait = 0.0 if self.on_credit else self.allow_latency
+            self.results.record(self.job_id, time.time(), compute_time, wait, comm_time,
+                                step_time or compute_time + wait + comm_time, payload_size, self.goodput)
+        if self.trace:
+            self.trace.record("finish", self.job_id, comm_time)
+        with self.lease_lock:
+            self.send(msg)
+            if self.leased:
+                self.credit -= self.payload_size
+            self.sending = False
+            if self.release_after:
+                # Revoked mid-transfer; the link is ours no longer
+                self.release_after = False
+                self.send({"job_id": self.job_id, "status": "RELEASE"})
+
+    def summary(self):
+        a, c = self.hist_allow, self.hist_comm
+        return (f"Job {self.job_id}: wait-for-ALLOW p50 {a.percentile(50):.4f}s p99 {a.percentile(99):.4f}s, "
+                f"comm p50 {c.percentile(50):.4f}s p99 {c.percentile(99):.4f}s")
+
+    def close(self):
+        with self.lease_lock:
+            if self.leased:
+                self.send({"job_id": self.job_id, "status": "RELEASE"})
+                self.leased = False
+
+def connect_scheduler(job_id, host, port, control_proto="json"):
+    """Open the control connection; returns (socket, whether it speaks the binary protocol).
+
+    With control_proto "auto" or "binary", the binary protocol is offered
+    first. A scheduler that predates it drops the connection, and with
+    "auto" we reconnect and speak JSON.
+    """
+    binary = control_proto != "json"
     while True:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Control messages are tiny and latency-bound; don't let Nagle hold them
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         try:
-            ctrl_sock.connect((scheduler_host, SCHEDULER_CONTROL_PORT))
-            break
+            sock.connect((host, port))
         except ConnectionRefusedError:
+            sock.close()
             time.sleep(1)
             print(f"Worker {job_id} waiting for scheduler...")
+            continue
+        if not binary or offer_binary(sock):
+            return sock, binary
+        sock.close()
+        if control_proto == "binary":
+            raise RuntimeError(f"Worker {job_id}: scheduler does not speak the binary control protocol")
+        print(f"Worker {job_id}: scheduler declined the binary control protocol, using JSON")
+        binary = False
+
+def offer_binary(sock, timeout=5.0):
+    """Send HELLO and wait for the scheduler's; False if it answers anything else or hangs up."""
+    reply = bytearray()
+    sock.settimeout(timeout)
+    try:
+        sock.sendall(encode_hello())
+        while len(reply) < HELLO_SIZE:
+            chunk = sock.recv(HELLO_SIZE - len(reply))
+            if not chunk:
+                return False
+            reply += chunk
+    except OSError:
+        return False
+    finally:
+        sock.settimeout(None)
+    return bool(parse_hello(bytes(reply)))
 
-    # Connect to Receiver (Data) - simulated by connecting to scheduler's data port for now or a separate receiver
-    # For this implementation, we'll assume the receiver is also the scheduler node but on a different port (or just a sink)
-    # In the plan, we said "Receiver (data)". Let's assume the scheduler also acts as the data sink for simplicity, 
-    # or we can spawn a separate receiver process. 
-    # Let's use a separate DATA port on the Scheduler host for the data sink.
-    data_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+def connect_sink(job_id, host, port, sock_buf, transport, shm_mb):
+    # The scheduler host also runs the data sink, on its own DATA port
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tune_socket(sock, sock_buf)
     while True:
         try:
-            data_sock.connect((receiver_host, WORKER_DATA_PORT))
+            sock.connect((host, port))
             break
         except ConnectionRefusedError:
             time.sleep(1)
-    
-    # Setup Model
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model = SimpleModel(model_size).to(device)
-    optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
-    input_data = torch.randn(64, model_size).to(device)
 
-    # Payload
-    payload_size = int(grad_mb * 1024 * 1024)
-    payload = b'a' * payload_size
+    if transport == "shm" or (transport == "auto" and is_loopback(host)):
+        # Same host: skip loopback TCP copies, keep the socket as the doorbell
+        stream = ShmStream.connect(sock, int(shm_mb * 1024 * 1024))
+        if stream:
+            print(f"Worker {job_id} sending over shared memory")
+            return stream
+        print(f"Worker {job_id}: receiver declined shared memory, using TCP")
+    return sock
 
-    for step in range(steps):
-        # 1. Compute
+class TrainingJob:
+    """A job's model and payload; jobs in one process share the torch runtime."""
+
+    __slots__ = ("model", "optimizer", "input_data", "device", "packer", "payload_size", "profile")
+
+    def __init__(self, model_size, grad_mb, payload_mode="synthetic", codec="none", topk_ratio=0.01, device="cpu"):
+        self.device = device
+        self.model = SimpleModel(model_size).to(device)
+        self.optimizer = torch.optim.SGD(self.model.parameters(), lr=0.01)
+        self.input_data = torch.randn(64, model_size).to(device)
+        if payload_mode == "grads":
+            # Real gradients: backward() writes into one flat buffer that is sent as is
+            self.packer = GradientPacker(self.model.parameters(), codec, topk_ratio)
+            self.payload_size = self.packer.payload_size
+            self.profile = f"{model_size}:grads:{codec}"
+        else:
+            self.packer = None
+            self.payload_size = int(grad_mb * 1024 * 1024)
+            self.profile = f"{model_size}:{grad_mb}"
+
+    def compute_step(self):
         start_comp = time.time()
-        optimizer.zero_grad()
-        out = model(input_data)
+        if self.packer:
+            self.packer.zero_grad()
+        else:
+            self.optimizer.zero_grad()
+        out = self.model(self.input_data)
         loss = out.sum()
         loss.backward()
-        optimizer.step()
-        if device == "cuda":
+        self.optimizer.step()
+        if self.device == "cuda":
             torch.cuda.synchronize()
-        compute_time = time.time() - start_comp
+        return time.time() - start_comp
 
-        # 2. Report Metrics
-        # We need to estimate throughput. For the first step, we don't know.
-        # Let's send the compute time and last step's comm time (or 0).
-        
-        # Protocol: Send metrics -> Wait for ALLOW -> Send Data -> Measure Comm Time
-        
-        # We need to send a request to send.
-        req = {
-            "job_id": job_id,
-            "compute_time": compute_time,
-            "payload_size": payload_size
-        }
-        send_json(ctrl_sock, req)
+def run_job(chan, job, steps, profiler, pipeline=False):
+    job_id = chan.job_id
+    trace = chan.trace
+    packer = job.packer
+    payload_size = job.payload_size
+    start_run = time.time()
+    if pipeline:
+        if packer:
+            buffers = [packer.new_buffer() for _ in range(2)]
+        else:
+            buffers = [bytearray(b'a' * payload_size) for _ in range(2)]
+        run_pipelined(chan, buffers, job.profile, steps, job.compute_step, profiler, packer.pack if packer else None)
+    else:
+        payload = b'a' * payload_size
+        payload_view = memoryview(payload)
+
+        for step in range(steps):
+            prof = profiler.begin()
+            # 1. Compute
+            compute_time = job.compute_step()
+            if trace:
+                trace.record("compute", job_id, compute_time)
+            if packer:
+                # Serialization is part of the step's local work
+                start_pack = time.time()
+                payload_view = packer.pack()
+                compute_time += time.time() - start_pack
+
+            # 2. Report Metrics
+            # We need to estimate throughput. For the first step, we don't know.
+            # Let's send the compute time and last step's comm time (or 0).
+            chan.request(compute_time, payload_size, job.profile)
+
+            # 3./4. Wait for Schedule, then Communicate
+            comm_time = chan.transfer(payload_view)
+            chan.finish(comm_time)
 
-        # 3. Wait for Schedule
+            print(f"Job {job_id}: Step {step}, Comp {compute_time:.4f}s, Comm {comm_time:.4f}s")
+            profiler.end(prof)
+            time.sleep(0.01) # Small sleep to prevent tight loops
+
+    print(f"Job {job_id}: done, {steps} steps in {time.time() - start_run:.3f}s")
+    print(chan.summary())
+
+def run_worker(job_id, scheduler_host, receiver_host, model_size, grad_mb, steps, sock_buf=SOCKET_BUFFER_SIZE,
+               pipeline=False, payload_mode="synthetic", codec="none", topk_ratio=0.01, trace_path=None,
+               control_port=SCHEDULER_CONTROL_PORT, data_port=WORKER_DATA_PORT, pace=False, transport="auto",
+               shm_mb=SHM_RING_SIZE / (1024 * 1024), coordinator=None, jobs=1, data_conns=2, results_path=None,
+               profile_path=None, control_proto="json"):
+    print(f"Worker {job_id} starting...")
+    # SIGUSR1 toggles the profiler; --profile runs it for the whole job
+    profiler = Profiler(profile_path or f"worker_{job_id}_profile.txt")
+    profiler.install_signal(signal.SIGUSR1)
+    if profile_path:
+        profiler.start()
+
+    if coordinator:
+        # Sharded cluster: the coordinator picks our scheduler/receiver
+        # (all jobs of a multi-job worker go where job_id is placed)
         while True:
-            resp = recv_json(ctrl_sock)
-            if resp and resp.get("command") == "ALLOW_SEND":
+            try:
+                shard = place_job(coordinator, job_id)
                 break
-            # If WAIT, we just wait for the next message. 
-            # The scheduler might send WAIT then ALLOW later? 
-            # Or we poll? The plan said "Wait for ALLOW". 
-            # Let's assume the scheduler sends ALLOW when it's our turn.
-        
-        # 4. Communicate
-        start_comm = time.time()
-        send_bulk(data_sock, payload)
-        # Wait for ack from receiver? TCP guarantees delivery, but app-level ack is good for timing.
-        # For simplicity, we count sendall time.
-        comm_time = time.time() - start_comm
-        
-        # Report completion to scheduler? 
-        # The scheduler needs to know we finished to schedule others.
-        # We can send a "FINISHED" message on control socket.
-        send_json(ctrl_sock, {"job_id": job_id, "status": "FINISHED", "comm_time": comm_time})
+            except (OSError, RuntimeError):
+                time.sleep(1)
+                print(f"Worker {job_id} waiting for coordinator...")
+        scheduler_host = receiver_host = shard["host"]
+        control_port, data_port = shard["control_port"], shard["data_port"]
+        print(f"Worker {job_id} placed on shard {shard['shard']} ({scheduler_host}:{control_port})")
+
+    # Jobs of a multi-job worker share one control connection and a pool of data connections
+    job_ids = [job_id] if jobs == 1 else [f"{job_id}{i}" for i in range(jobs)]
+    ctrl = ControlConnection(*connect_scheduler(job_id, scheduler_host, control_port, control_proto))
+    def connect_data():
+        return connect_sink(job_id, receiver_host, data_port, sock_buf, transport, shm_mb)
+    data = DataPool([connect_data() for _ in range(max(1, min(data_conns, jobs)))], connect_data)
+
+    trace = None
+    if trace_path:
+        trace = EventTrace()
+        trace.start_flusher(trace_path)
+    results = StepLog(results_path, role="worker") if results_path else None
+    chans = [JobChannel(jid, ctrl, data, trace, pace, results) for jid in job_ids]
+    ctrl.start()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if jobs > 1:
+        # One runtime for all jobs: split the CPU rather than oversubscribe it
+        torch.set_num_threads(max(1, torch.get_num_threads() // jobs))
+    models = [TrainingJob(model_size, grad_mb, payload_mode, codec, topk_ratio, device) for _ in job_ids]
+
+    if jobs == 1:
+        run_job(chans[0], models[0], steps, profiler, pipeline)
+    else:
+        errors = []
+
+        def target(chan, job):
+            try:
+                run_job(chan, job, steps, profiler, pipeline)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=target, args=(c, j)) for c, j in zip(chans, models)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+
+    if trace:
+        with open(trace_path, "a") as f:
+            trace.flush(f)
+    if results:
+        results.save()
+    profiler.stop()
+    for chan in chans:
+        chan.close()
+    ctrl.close()
+    data.close()
 
-        print(f"Job {job_id}: Step {step}, Comp {compute_time:.4f}s, Comm {comm_time:.4f}s")
-        time.sleep(0.01) # Small sleep to prevent tight loops
+def run_pipelined(chan, buffers, profile, steps, compute_step, profiler, fill=None):
+    """Overlap step N's transfer with step N+1's compute.
+
+    Gradients go into one of two payload buffers (via `fill`, if given); a
+    sender thread does the job's requests and transfers, transmitting filled
+    buffers in order, still asking the scheduler before each transfer.
+    Compute blocks only when both buffers are waiting to be sent.
+    """
+    payload_size = len(buffers[0])
+    free = queue.Queue()
+    for idx in range(len(buffers)):
+        free.put(idx)
+    todo = queue.Queue()
+    errors = []
+
+    def sender():
+        last_done = None
+        try:
+            while True:
+                item = todo.get()
+                if item is None:
+                    return
+                step, idx, compute_time = item
+                prof = profiler.begin()
+                chan.request(compute_time, payload_size, profile, overlap=True)
+                comm_time = chan.transfer(memoryview(buffers[idx]))
+                free.put(idx)
+
+                # With overlap, a step costs max(compute, wait + comm) rather than
+                # the sum, so report the measured pipeline period as well
+                now = time.time()
+                chan.finish(comm_time, now - last_done if last_done is not None else None)
+                last_done = now
+
+                print(f"Job {chan.job_id}: Step {step}, Comp {compute_time:.4f}s, Comm {comm_time:.4f}s (pipelined)")
+                profiler.end(prof)
+        except Exception as e:
+            errors.append(e)
+            # Keep the compute loop from blocking on a buffer that never frees
+            free.put(None)
+
+    t = threading.Thread(target=sender)
+    t.daemon = True
+    t.start()
+
+    for step in range(steps):
+        prof = profiler.begin()
+        compute_time = compute_step()
+        if chan.trace:
+            chan.trace.record("compute", chan.job_id, compute_time)
+        profiler.end(prof)
+        idx = free.get()
+        if idx is None:
+            break
+        if fill:
+            start_pack = time.time()
+            fill(buffers[idx])
+            compute_time += time.time() - start_pack
+        todo.put((step, idx, compute_time))
 
-    ctrl_sock.close()
-    data_sock.close()
+    todo.put(None)
+    t.join()
+    if errors:
+        raise errors[0]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -112,6 +628,45 @@ if __name__ == "__main__":
     parser.add_argument("--model_size", type=int, default=1024)
     parser.add_argument("--grad_mb", type=float, default=10)
     parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--control_port", type=int, default=SCHEDULER_CONTROL_PORT)
+    parser.add_argument("--data_port", type=int, default=WORKER_DATA_PORT)
+    parser.add_argument("--sock_buf_mb", type=float, default=SOCKET_BUFFER_SIZE / (1024 * 1024))
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap each step's transfer with the next step's compute")
+    parser.add_argument("--payload", choices=["synthetic", "grads"], default="synthetic",
+                        help="Send a constant --grad_mb blob, or the model's real gradients")
+    parser.add_argument("--codec", choices=sorted(CODECS), default="none",
+                        help="Gradient compression for --payload grads")
+    parser.add_argument("--topk_ratio", type=float, default=0.01,
+                        help="Fraction of gradient entries kept by --codec topk")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Append per-step events (compute/request/send/finish) to this JSONL file")
+    parser.add_argument("--coordinator", type=str, default=None,
+                        help="host:port of coordinator.py; overrides the scheduler/receiver hosts and ports")
+    parser.add_argument("--transport", choices=["auto", "tcp", "shm"], default="auto",
+                        help="Payload transport; auto uses shared memory when the receiver is on loopback")
+    parser.add_argument("--shm_mb", type=float, default=SHM_RING_SIZE / (1024 * 1024),
+                        help="Shared-memory ring size for --transport shm")
+    parser.add_argument("--pace", action="store_true",
+                        help="Token-bucket pace transfers at the rate the scheduler assigns (--link_gbps)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Run this many jobs (<job_id>0, <job_id>1, ...) in one process over shared connections")
+    parser.add_argument("--data_conns", type=int, default=2,
+                        help="Data connections shared by the jobs of a --jobs worker")
+    parser.add_argument("--results", type=str, default=None,
+                        help="Save per-step records (compute, wait, comm, bytes, goodput) to this .npz file")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="Profile the run and write per-function CPU time here "
+                             "(SIGUSR1 toggles profiling either way)")
+    parser.add_argument("--control_proto", choices=["json", "auto", "binary"], default="json",
+                        help="Control protocol; auto offers the compact binary one and falls back to JSON "
+                             "for schedulers that do not speak it, binary requires it")
     args = parser.parse_args()
 
-    run_worker(args.job_id, args.scheduler_host, args.receiver_host, args.model_size, args.grad_mb, args.steps)
+    run_worker(args.job_id, args.scheduler_host, args.receiver_host, args.model_size, args.grad_mb, args.steps,
+               int(args.sock_buf_mb * 1024 * 1024), pipeline=args.pipeline, payload_mode=args.payload,
+               codec=args.codec, topk_ratio=args.topk_ratio, trace_path=args.trace,
+               control_port=args.control_port, data_port=args.data_port, pace=args.pace,
+               transport=args.transport, shm_mb=args.shm_mb, coordinator=args.coordinator, jobs=args.jobs,
+               data_conns=args.data_conns, results_path=args.results, profile_path=args.profile,
+               control_proto=args.control_proto)